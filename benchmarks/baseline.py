@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+The package as of another revision, for benchmarks that compare against the
+code a change replaced, without keeping copies of old implementations.
+
+Set SEC_BASELINE to a git revision of this repository, or to the path of a
+directory holding another copy of the single_edit_code package:
+
+    SEC_BASELINE=48a7ac6 python -m benchmarks.bench_checksums
+
+Benchmarks only report the current code when it is not set.
+"""
+
+import atexit
+import importlib.util
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_loaded = {}
+
+def _extract(ref):
+    # The package directory at git revision ref, extracted to a temporary directory
+    data = subprocess.run(["git", "archive", ref, "single_edit_code"], cwd=ROOT,
+                          capture_output=True, check=True).stdout
+    directory = tempfile.mkdtemp(prefix="sec_baseline_")
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    kwargs = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        tar.extractall(directory, **kwargs)
+    return directory
+
+def load(ref=None):
+    """
+    Import single_edit_code from ref, defaulting to $SEC_BASELINE, as a
+    separate package named sec_baseline (sec_baseline1, ... for further refs).
+    Return: the package, or None if no baseline is set
+    """
+    ref = ref or os.environ.get("SEC_BASELINE")
+    if not ref:
+        return None
+    if ref not in _loaded:
+        directory = ref if os.path.isdir(os.path.join(ref, "single_edit_code")) else _extract(ref)
+        init = os.path.join(directory, "single_edit_code", "__init__.py")
+        name = "sec_baseline" + (str(len(_loaded)) if _loaded else "")
+        spec = importlib.util.spec_from_file_location(
+            name, init, submodule_search_locations=[os.path.dirname(init)])
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        _loaded[ref] = module
+    return _loaded[ref]
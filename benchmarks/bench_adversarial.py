@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+SumBalancedCode on a corpus of adversarial and low-entropy inputs, which
+contain many forbidden words. For each input and length it reports the
+number of replacements and the encode and decode times, with and without
+whitening. The time per replacement should stay flat as the length grows.
+With SEC_BASELINE set (see baseline.py), decoding without whitening is also
+timed with the baseline's SumBalancedCode.
+
+Run from the repository root as `python -m benchmarks.bench_adversarial`.
+"""
+
+import time
+import numpy as np
+import single_edit_code as sec
+from . import baseline
+
+def sparse_float32(l, rng, density=0.02):
+    # Sparse scientific data: float32 values, mostly exactly zero
+    values = np.where(rng.rand(-(-l // 16)) < density, rng.randn(-(-l // 16)), 0)
+    return sec.bytes_to_quaternary(values.astype(np.float32).tobytes())[:l]
+
+def corpus(k, rng):
+    """
+    Return: dict of name -> function of the length l giving an input
+    """
+    return {
+        "uniform": lambda l: rng.randint(0, 4, size=l),
+        "zeros": lambda l: np.zeros(l, dtype=int),
+        "threes": lambda l: np.full(l, 3),
+        "ones": lambda l: np.ones(l, dtype=int),
+        "low entropy": lambda l: rng.choice(4, size=l, p=[0.85, 0.05, 0.05, 0.05]),
+        "sparse": lambda l: np.where(rng.rand(l) < 0.02, rng.randint(1, 4, size=l), 0),
+        "k-runs 0/3": lambda l: np.resize(np.repeat([0, 3], k), l),
+        "sparse float32": lambda l: sparse_float32(l, rng),
+    }
+
+def timed(f):
+    start = time.perf_counter()
+    result = f()
+    return result, time.perf_counter() - start
+
+def main(k=128, lengths=(10000, 40000, 160000)):
+    rng = np.random.RandomState(0)
+    codes = {False: sec.SumBalancedCode(k), True: sec.SumBalancedCode(k, whiten=True)}
+    old = baseline.load()
+    old_code = old.SumBalancedCode(k) if old is not None else None
+    print(f"k = {k}")
+    print(f"{'input':>15} {'l':>7} {'whiten':>6} {'replaced':>9} {'encode(ms)':>11} "
+          f"{'decode(ms)':>11} {'baseline(ms)':>13} {'us/replacement':>15}")
+    for name, make in corpus(k, rng).items():
+        for l in lengths:
+            x = sec.QaryString(4, make(l))
+            for whiten, code in codes.items():
+                code.cache_clear()
+                with sec.Stats() as stats:
+                    (y, _), t_enc = timed(lambda: code.encode(x))
+                replaced = stats.histograms["sum_balance.replacements"].total
+                code.cache_clear()
+                decoded, t_dec = timed(lambda: code.decode(y, l))
+                assert decoded == x
+                t_old = ""
+                if old is not None and not whiten:
+                    z, t_old = timed(lambda: old_code.decode(old.QaryString(4, y.val), l))
+                    assert np.array_equal(z.val, x.val)
+                    t_old = f"{t_old*1e3:.1f}"
+                per = f"{(t_enc + t_dec) / replaced * 1e6:.1f}" if replaced else "-"
+                print(f"{name:>15} {l:>7} {str(whiten):>6} {replaced:>9} {t_enc*1e3:>11.1f} "
+                      f"{t_dec*1e3:>11.1f} {t_old:>13} {per:>15}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Memory allocated by a full encode/decode cycle, measured with tracemalloc
+as the peak above the memory held before the cycle, and the number of
+QaryStrings built. With SEC_BASELINE set (see baseline.py), the cycle is
+also measured with the baseline's SingleEditCode.
+
+Also the memory held by slices of one string, for QaryString, which
+copies, and QaryView, which does not.
+
+Run from the repository root as `python -m benchmarks.bench_alloc`.
+"""
+
+import time
+import tracemalloc
+from unittest import mock
+import numpy as np
+import single_edit_code as sec
+from . import baseline
+
+def count_strings():
+    """
+    Patch QaryString construction to count the strings built.
+    Return: (list of patchers, counter dict)
+    """
+    counter = {"strings": 0}
+    init, wrap = sec.QaryString.__init__, sec.QaryString._wrap.__func__
+    def counted_init(self, *args, **kwargs):
+        counter["strings"] += 1
+        init(self, *args, **kwargs)
+    def counted_wrap(cls, *args):
+        counter["strings"] += 1
+        return wrap(cls, *args)
+    view_init = sec.QaryView.__init__
+    def counted_view_init(self, *args, **kwargs):
+        counter["strings"] += 1
+        view_init(self, *args, **kwargs)
+    patches = [mock.patch.object(sec.QaryString, "__init__", counted_init),
+               mock.patch.object(sec.QaryString, "_wrap", classmethod(counted_wrap)),
+               mock.patch.object(sec.QaryView, "__init__", counted_view_init)]
+    return patches, counter
+
+def traced(f):
+    """
+    Run f under tracemalloc.
+    Return: (peak bytes above the start, seconds, strings built)
+    """
+    patches, counter = count_strings()
+    for p in patches: p.start()
+    try:
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        t = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - t
+        peak = tracemalloc.get_traced_memory()[1] - start
+        tracemalloc.stop()
+    finally:
+        for p in patches: p.stop()
+    return peak, elapsed, counter["strings"]
+
+def cycle(code, x, mtype):
+    x_enc, n, N, l = code.encode(x)
+    y = x_enc if mtype is None else x_enc.mutate(mtype)[0]
+    assert np.array_equal(code.decode(y, n, N, l).val, x.val)
+
+def main(k=64, lengths=(1000, 10000, 100000)):
+    code = sec.SingleEditCode(k)
+    old = baseline.load()
+    old_code = old.SingleEditCode(k) if old is not None else None
+    rng = np.random.RandomState(0)
+    print(f"k = {k}, peak memory above start (KiB), strings built, time (ms)")
+    print(f"{'l':>7} {'edit':>11} {'peak':>9} {'strings':>8} {'ms':>8}" +
+          (f" {'baseline peak':>14} {'baseline ms':>12}" if old is not None else ""))
+    for l in lengths:
+        x = sec.QaryString(4, rng.randint(0, 4, size=l))
+        for mtype in [None, "substitute", "insert", "delete"]:
+            cycle(code, x, mtype)
+            np.random.seed(0)
+            peak, elapsed, strings = traced(lambda: cycle(code, x, mtype))
+            row = f"{l:>7} {str(mtype):>11} {peak/1024:>9.1f} {strings:>8} {elapsed*1e3:>8.2f}"
+            if old is not None:
+                old_x = old.QaryString(4, x.val)
+                np.random.seed(0)
+                old_peak, old_elapsed, _ = traced(lambda: cycle(old_code, old_x, mtype))
+                row += f" {old_peak/1024:>14.1f} {old_elapsed*1e3:>12.2f}"
+            print(row)
+
+    print("\n1000 slices of 1000 symbols each, held alive (KiB)")
+    for cls in [sec.QaryString, sec.QaryView]:
+        x = cls(4, rng.randint(0, 4, size=10**6).astype(np.int8))
+        tracemalloc.start()
+        slices = [x[1000*i:1000*i+1000] for i in range(1000)]
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{cls.__name__:>12} {held/1024:>9.1f}")
+        del slices
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Per-call cost of the QaryString base conversions on a forbidden word of
+length k, and of ranking and unranking the word with the caches of
+SumBalancedCode disabled. With SEC_BASELINE set (see baseline.py), the
+conversions are also timed with the baseline's QaryString.
+
+Run from the repository root as `python -m benchmarks.bench_base_conversion`.
+"""
+
+import time
+import numpy as np
+import single_edit_code as sec
+from . import baseline
+
+def mean_time(f, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        f()
+    return (time.perf_counter() - start) / repeat
+
+def conversions(module, val, index):
+    """
+    The four conversions with the QaryString of module, checked against
+    the current package.
+    Return: list of (name, function)
+    """
+    word, expected = module.QaryString(4, val), sec.QaryString(4, val)
+    m = expected.as_binary_matrix[1]
+    assert np.all(word.as_binary_matrix[1] == m)
+    assert np.array_equal(module.QaryString.from_binary_matrix(4, m).val, val)
+    assert word.asint() == expected.asint()
+    assert np.array_equal(word.fromint(index).val, expected.fromint(index).val)
+    return [
+        ("as_binary_matrix", lambda: word.as_binary_matrix),
+        ("from_binary_matrix", lambda: module.QaryString.from_binary_matrix(4, m)),
+        ("asint", lambda: word.asint()),
+        ("fromint", lambda: word.fromint(index)),
+    ]
+
+def main(k=512, repeat=200):
+    code = sec.SumBalancedCode(k, cache_size=0)
+    old = baseline.load()
+    # Symbols in {0, 1} sum to less than k, so the word is forbidden
+    val = np.random.RandomState(0).randint(0, 2, size=k)
+    word = sec.QaryString(4, val)
+    index = code._fword_to_index(word)
+    cases = conversions(sec, val, index)
+    old_cases = conversions(old, val, index) if old is not None else [(None, None)] * len(cases)
+
+    print(f"k = {k}")
+    print(f"{'':>20} {'us':>9}" + (f" {'baseline(us)':>13}" if old is not None else ""))
+    for (name, new), (_, prev) in zip(cases, old_cases):
+        row = f"{name:>20} {mean_time(new, repeat)*1e6:>9.1f}"
+        if prev is not None:
+            row += f" {mean_time(prev, repeat)*1e6:>13.1f}"
+        print(row)
+    print(f"{'rank':>20} {mean_time(lambda: code._fword_to_index(word), repeat)*1e6:>9.1f}")
+    print(f"{'unrank':>20} {mean_time(lambda: code._index_to_fword(index), repeat)*1e6:>9.1f}")
+
+if __name__ == "__main__":
+    main()
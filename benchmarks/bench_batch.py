@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput in strands/sec of SingleEditCode.encode_batch / decode_batch
+compared with calling encode / decode once per strand.
+
+Run from the repository root as `python -m benchmarks.bench_batch`.
+"""
+
+import time
+import numpy as np
+import single_edit_code as sec
+
+def throughput(f, count):
+    start = time.perf_counter()
+    f()
+    return count / (time.perf_counter() - start)
+
+def main(k=64, length=150, num_strands=2000, error_rate=0.1):
+    rng = np.random.RandomState(0)
+    code = sec.SingleEditCode(k)
+    X = rng.randint(0, 4, size=(num_strands, length)).astype(np.uint8)
+
+    X_enc, n, N, l = code.encode_batch(X)
+    # Mutate a fraction of the strands with a random edit
+    received = []
+    for i in range(num_strands):
+        x_enc = sec.QaryString(4, X_enc[i, :N[i]])
+        if rng.rand() < error_rate:
+            x_enc = x_enc.mutate()[0]
+        received.append(x_enc)
+
+    def encode_single():
+        for row in X:
+            code.encode(sec.QaryString(4, row))
+
+    def decode_single():
+        for i, x_enc in enumerate(received):
+            code.decode(x_enc, n[i], N[i], l[i])
+
+    print(f"k = {k}, message length = {length}, strands = {num_strands}, "
+          f"error rate = {error_rate}")
+    print(f"encode        {throughput(encode_single, num_strands):>10.0f} strands/sec")
+    print(f"encode_batch  {throughput(lambda: code.encode_batch(X), num_strands):>10.0f} strands/sec")
+    print(f"decode        {throughput(decode_single, num_strands):>10.0f} strands/sec")
+    rows = [x.val for x in received]
+    print(f"decode_batch  {throughput(lambda: code.decode_batch(rows, n, N, l), num_strands):>10.0f} strands/sec")
+
+if __name__ == "__main__":
+    main(error_rate=0.0)
+    main(error_rate=0.1)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Memory and time per codeword of the SingleEditCode checksums, computed by
+the fused util.checksums pass. With SEC_BASELINE set (see baseline.py),
+also of the separate QaryString properties of the baseline (syndrome,
+signature.syndrome, signature.parity_check, sum). Memory is the peak of
+temporary allocations during one call, as seen by tracemalloc.
+
+Run from the repository root as `python -m benchmarks.bench_checksums`.
+"""
+
+import time
+import tracemalloc
+import numpy as np
+import single_edit_code as sec
+from . import baseline
+
+def separate(x, P):
+    # The checksums as the baseline's SingleEditCode.encode computes them
+    return x.syndrome, x.signature.syndrome % P, x.signature.parity_check, x.sum
+
+def peak_bytes(f):
+    f()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    f()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return peak
+
+def mean_time(f, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        f()
+    return (time.perf_counter() - start) / repeat
+
+def main(lengths=(150, 1000, 10000, 100000), k=64, repeat=50):
+    rng = np.random.RandomState(0)
+    old = baseline.load()
+    P = 20*k
+    header = f"{'n':>8} {'fused(B)':>10} {'fused(us)':>10}"
+    if old is not None:
+        header += f" {'baseline(B)':>12} {'baseline(us)':>13}"
+    print(header)
+    for n in lengths:
+        val = rng.randint(0, 4, size=n).astype(np.int8)
+        fused = lambda: sec.util.checksums(val, P)
+        row = f"{n:>8} {peak_bytes(fused):>10} {mean_time(fused, repeat)*1e6:>10.1f}"
+        if old is not None:
+            x = old.QaryString(4, val)
+            assert tuple(int(v) for v in separate(x, P)) == fused()
+            row += f" {peak_bytes(lambda: separate(x, P)):>12} {mean_time(lambda: separate(x, P), repeat)*1e6:>13.1f}"
+        print(row)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Import time of the package, measured in fresh interpreters with
+`python -X importtime`: importing the package alone, and importing it and
+building a SingleEditCode (which loads the modules it needs). Times are of
+the statement's own imports, i.e. without interpreter startup. Also lists
+the slowest modules imported in the second case.
+
+Run from the repository root as `python -m benchmarks.bench_import`.
+"""
+
+import os
+import subprocess
+import sys
+
+STATEMENTS = {
+    "import": "import single_edit_code",
+    "import + SingleEditCode(64)": "import single_edit_code as sec; sec.SingleEditCode(64)",
+}
+
+def importtime(statement):
+    """
+    Run statement in a new interpreter with -X importtime.
+    Return: list of (depth, module, cumulative microseconds), in the order
+            reported
+    """
+    path = os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")]))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                          env=dict(os.environ, PYTHONPATH=path),
+                          capture_output=True, text=True, check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((depth, name.strip(), int(cumulative)))
+    return rows
+
+def statement_time(statement):
+    """
+    Microseconds spent in top-level imports made by statement beyond those
+    made at interpreter startup
+    """
+    startup = {name for depth, name, us in importtime("pass")}
+    return sum(us for depth, name, us in importtime(statement)
+               if depth == 0 and name not in startup)
+
+def main(repeat=5, top=8):
+    for label, statement in STATEMENTS.items():
+        best = min(statement_time(statement) for i in range(repeat))
+        modules = {name for depth, name, us in importtime(statement)}
+        print(f"{label:<30} {best/1000:>8.1f} ms (best of {repeat}), "
+              f"scipy imported: {'scipy' in modules}")
+    print(f"\nSlowest modules for '{statement}':")
+    rows = sorted(importtime(statement), key=lambda row: -row[2])
+    for depth, name, us in rows[:top]:
+        print(f"{name:<40} {us/1000:>8.1f} ms")
+
+if __name__ == "__main__":
+    main()
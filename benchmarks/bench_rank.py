@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Per-word cost of ranking/unranking k-length bitstrings, comparing the
+binomial-evaluating CombinatorialBitstringEncoder with the table-backed
+BinomialTable used by SumBalancedCode.
+
+Run from the repository root as `python -m benchmarks.bench_rank`.
+"""
+
+import time
+import numpy as np
+import single_edit_code as sec
+
+def per_call(f, args, repeat):
+    start = time.perf_counter()
+    for a in args[:repeat]:
+        f(*a)
+    return (time.perf_counter() - start) / repeat
+
+def main(ks=(32, 64, 132, 512), num_words=200):
+    rng = np.random.RandomState(0)
+    print(f"{'k':>5} {'build(ms)':>10} {'rank(us)':>10} {'table(us)':>10} "
+          f"{'unrank(us)':>11} {'table(us)':>10}")
+    for k in ks:
+        start = time.perf_counter()
+        table = sec.BinomialTable(k)
+        build = time.perf_counter() - start
+
+        words = [rng.randint(0, 2, size=k) for _ in range(num_words)]
+        ranked = [table.rank(w) for w in words]
+        # The reference decoder is much slower for large k; sample fewer words.
+        repeat = max(5, num_words * 32 // k)
+
+        rank_ref = per_call(sec.CombinatorialBitstringEncoder.encode,
+                            [(w,) for w in words], num_words)
+        rank_tab = per_call(table.rank, [(w,) for w in words], num_words)
+        unrank_ref = per_call(sec.CombinatorialBitstringEncoder.decode,
+                              ranked, min(repeat, num_words))
+        unrank_tab = per_call(table.unrank, [r[1:] for r in ranked], num_words)
+        print(f"{k:>5} {build*1e3:>10.2f} {rank_ref*1e6:>10.1f} {rank_tab*1e6:>10.1f} "
+              f"{unrank_ref*1e6:>11.1f} {unrank_tab*1e6:>10.1f}")
+
+if __name__ == "__main__":
+    main()
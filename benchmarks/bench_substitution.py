@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Substitution decoding latency across strand lengths n, with the closed-form
+locator of SingleEditCode._decode_substitution. With SEC_BASELINE set (see
+baseline.py), also of the baseline's decoder on the same codewords.
+
+Run from the repository root as `python -m benchmarks.bench_substitution`.
+"""
+
+import time
+import numpy as np
+import single_edit_code as sec
+from . import baseline
+
+def mean_time(f, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        f()
+    return (time.perf_counter() - start) / repeat
+
+def main(lengths=(100, 1000, 10000, 100000), k=64, repeat=20):
+    rng = np.random.RandomState(0)
+    code = sec.SingleEditCode(k)
+    old = baseline.load()
+    old_code = old.SingleEditCode(k) if old is not None else None
+    print(f"{'n':>8} {'decode(us)':>11}" + (f" {'baseline(us)':>13}" if old is not None else ""))
+    for length in lengths:
+        x = sec.QaryString(4, rng.randint(0, 4, size=length))
+        x_enc, n, N, l = code.encode(x)
+        # Substitute a symbol near the end, the worst case for a linear search over j
+        pos = n - 1 - rng.randint(0, 4)
+        x_enc_m = x_enc._substitute(pos, (x_enc.val[pos] + 1) % 4)
+        assert code._decode_substitution(x_enc_m, n, False) == x_enc[:n]
+
+        row = f"{n:>8} {mean_time(lambda: code._decode_substitution(x_enc_m, n, False), repeat)*1e6:>11.1f}"
+        if old is not None:
+            y = old.QaryString(4, x_enc_m.val)
+            assert np.array_equal(old_code._decode_substitution(y, n, False).val, x_enc.val[:n])
+            row += f" {mean_time(lambda: old_code._decode_substitution(y, n, False), repeat)*1e6:>13.1f}"
+        print(row)
+
+if __name__ == "__main__":
+    main()
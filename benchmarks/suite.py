@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite with parametrised sweeps over message length, k, input
+entropy and error type. It times:
+    precompute  SumBalancedCode._compute_buckets
+    encode      SingleEditCode.encode
+    decode      SingleEditCode.decode, i.e. each of the _decode_* paths
+                selected by the error type
+
+Results are written as JSON, and can be compared against a saved baseline:
+
+    python -m benchmarks.suite --out baseline.json
+    python -m benchmarks.suite --compare baseline.json --threshold 0.2
+
+In compare mode the exit status is 1 if any case is slower than its
+baseline by more than the threshold.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+import single_edit_code as sec
+
+ENTROPIES = {
+    # Probabilities of the symbols 0, 1, 2, 3
+    "uniform": [0.25, 0.25, 0.25, 0.25],
+    "low": [0.85, 0.05, 0.05, 0.05],
+    "constant": [1.0, 0.0, 0.0, 0.0],
+}
+ERRORS = {
+    "none": None,
+    "substitution": "substitute",
+    "insertion": "insert",
+    "deletion": "delete",
+}
+
+def messages(entropy, length, count, rng):
+    return rng.choice(4, size=(count, length), p=ENTROPIES[entropy])
+
+def timings(f, items):
+    """
+    Time f(item) for each item. Return: per-call times in seconds
+    """
+    times = []
+    for item in items:
+        start = time.perf_counter()
+        f(item)
+        times.append(time.perf_counter() - start)
+    return times
+
+def result(name, params, times, failures=0):
+    times = np.array(times)
+    return {"name": name, "params": params, "count": len(times),
+            "median_us": float(np.median(times) * 1e6),
+            "mean_us": float(times.mean() * 1e6),
+            "min_us": float(times.min() * 1e6),
+            "failures": failures}
+
+def bench_precompute(ks, repeat):
+    for k in ks:
+        code = sec.SumBalancedCode(k)
+        yield result("precompute", {"k": k}, timings(lambda _: code._compute_buckets(), range(repeat)))
+
+def bench_codec(ks, lengths, entropies, errors, count, seed):
+    for k in ks:
+        code = sec.SingleEditCode(k)
+        for length in lengths:
+            for entropy in entropies:
+                rng = np.random.RandomState(seed)
+                # QaryString.mutate draws from the global generator
+                np.random.seed(seed)
+                # Each case starts from cold forbidden-word caches
+                code.sbcode.cache_clear()
+                xs = [sec.QaryString(4, m) for m in messages(entropy, length, count, rng)]
+                encoded = []
+                params = {"k": k, "length": length, "entropy": entropy}
+                times = timings(lambda x: encoded.append(code.encode(x)), xs)
+                yield result("encode", params, times)
+                for error in errors:
+                    received = [(x_enc if ERRORS[error] is None else x_enc.mutate(mtype=ERRORS[error])[0],
+                                 n, N, l) for x_enc, n, N, l in encoded]
+                    decoded = []
+                    def decode(item):
+                        try:
+                            decoded.append(code.decode(*item))
+                        except Exception:
+                            decoded.append(None)
+                    times = timings(decode, received)
+                    failures = sum(not (y is not None and y == x) for x, y in zip(xs, decoded))
+                    yield result("decode", dict(params, error=error), times, failures)
+
+def run(ks, lengths, entropies, errors, count, repeat, seed=0, verbose=True):
+    results = []
+    for r in bench_precompute(ks, repeat):
+        results.append(r)
+        if verbose: print(_format(r))
+    for r in bench_codec(ks, lengths, entropies, errors, count, seed):
+        results.append(r)
+        if verbose: print(_format(r))
+    return {"meta": {"python": platform.python_version(), "numpy": np.__version__,
+                     "machine": platform.machine(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                     "count": count, "repeat": repeat, "seed": seed},
+            "results": results}
+
+def _key(r):
+    return r["name"] + "".join(f" {p}={v}" for p, v in sorted(r["params"].items()))
+
+def _format(r):
+    fail = f"  FAILURES={r['failures']}" if r["failures"] else ""
+    return f"{_key(r):<60} {r['median_us']:>12.1f} us{fail}"
+
+def compare(current, baseline, threshold):
+    """
+    Match cases by name and parameters and print the ratio of median times.
+    Return: list of keys of cases slower than baseline by more than threshold
+    """
+    base = {_key(r): r for r in baseline["results"]}
+    regressions = []
+    print(f"{'case':<60} {'baseline(us)':>13} {'current(us)':>12} {'ratio':>7}")
+    for r in current["results"]:
+        key = _key(r)
+        if key not in base:
+            print(f"{key:<60} {'-':>13} {r['median_us']:>12.1f}")
+            continue
+        ratio = r["median_us"] / base[key]["median_us"]
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(f"{key:<60} {base[key]['median_us']:>13.1f} {r['median_us']:>12.1f} {ratio:>7.2f}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--k", type=int, nargs="+", default=[64, 128])
+    parser.add_argument("--length", type=int, nargs="+", default=[150, 1000])
+    parser.add_argument("--entropy", nargs="+", default=list(ENTROPIES), choices=list(ENTROPIES))
+    parser.add_argument("--error", nargs="+", default=list(ERRORS), choices=list(ERRORS))
+    parser.add_argument("--count", type=int, default=100, help="messages per case")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each precomputation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    current = run(args.k, args.length, args.entropy, args.error, args.count,
+                  args.repeat, args.seed, verbose=args.compare is None)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(current, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        return 1 if compare(current, baseline, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,10 +3,51 @@
 Created on Mon Mar 23 22:03:47 2020
 
 @author: Daniel Tan
+
+Submodules are imported on first access to one of their names, so that
+`import single_edit_code` itself is cheap.
 """
 
-from .single_edit_code import *
-from .util import *
-from .svt_code import *
-from .sum_balanced_code import *
-from .qary_string import *
\ No newline at end of file
+import importlib
+
+_submodules = ["single_edit_code", "util", "svt_code", "sum_balanced_code",
+               "qary_string", "parallel", "stream", "archive", "table_cache", "channel",
+               "stats"]
+
+# Public name -> submodule defining it
+_exports = {}
+for _module, _names in [
+    ("single_edit_code", ["SingleEditCode", "LengthPlan"]),
+    ("util", ["syndrome", "signature", "parity_check", "checksums", "checksums_batch",
+              "multiplicative_inverse", "small_inverses", "to_digits", "from_digits",
+              "int_from_digits", "int_to_digits", "keystream", "pack_2bit", "unpack_2bit",
+              "packed_sum", "packed_syndrome", "packed_signature", "is_sum_balanced",
+              "window_sums", "forbidden_windows", "is_k_sum_balanced"]),
+    ("svt_code", ["SVTCode", "first_index_k_zeros_left", "first_index_k_ones_right"]),
+    ("sum_balanced_code", ["binom", "CombinatorialBitstringEncoder", "BinomialTable",
+                           "SumBalancedCode"]),
+    ("qary_string", ["QaryString", "QaryView", "PackedQaryString"]),
+    ("parallel", ["ItemError", "decode_rows", "decode_timed", "SingleEditCodePool"]),
+    ("stream", ["Frame", "bytes_to_quaternary", "quaternary_to_bytes", "encode_stream",
+                "decode_stream", "encode_file", "decode_to_file"]),
+    ("archive", ["ArchiveWriter", "write_archive", "ArchiveReader"]),
+    ("channel", ["ERROR_TYPES", "ChannelReport", "inject_errors", "simulate"]),
+    ("stats", ["Stats", "Histogram"]),
+]:
+    for _name in _names:
+        _exports[_name] = _module
+del _module, _names, _name
+
+__all__ = list(_exports)
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    if name in _exports:
+        value = getattr(importlib.import_module("." + _exports[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports) | set(_submodules))
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Compact container format for many codewords with their decoding parameters.
+
+File layout (all little-endian):
+    header      magic "SECA", version, q, number of records, byte offset
+                of the index
+    records     for each codeword: varints length, n, N, l, followed by
+                the codeword packed 2 bits per symbol (see util.pack_2bit)
+    index       (count+1) uint64 byte offsets of the records; the last
+                entry is the end of the records
+
+Records are read from a memory map: a codeword is returned as a
+PackedQaryString over the mapped bytes, without copying. Decoding a subset
+of the records only reads the pages holding them and their index entries.
+"""
+
+import mmap
+import struct
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .qary_string import PackedQaryString
+from .parallel import SingleEditCodePool, ItemError, decode_rows
+from .stream import Frame
+from .util import pack_2bit
+
+MAGIC = b"SECA"
+VERSION = 1
+_HEADER = struct.Struct("<4sHHQQ")
+
+def _encode_varint(x):
+    """
+    Unsigned LEB128 encoding of a non-negative int
+    """
+    out = bytearray()
+    while True:
+        b = x & 0x7f
+        x >>= 7
+        if x:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+def _decode_varint(buf, pos):
+    """
+    Return: (value, position after the varint)
+    """
+    x = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        x |= (b & 0x7f) << shift
+        if b < 0x80:
+            return x, pos
+        shift += 7
+
+class ArchiveWriter:
+    """
+    Writes codewords to a container file. Use as a context manager, or call
+    close() when done; the index is written on close.
+    """
+    def __init__(self, path, q=4):
+        if q > 4:
+            raise Exception("ArchiveWriter requires q <= 4")
+        self.q = q
+        self.file = open(path, "wb")
+        self.file.write(_HEADER.pack(MAGIC, VERSION, q, 0, 0))
+        self.offsets = [_HEADER.size]
+
+    def write(self, codeword, n, N, l):
+        """
+        codeword :  QaryString or 1-D array; may differ in length from N
+        n, N, l :   as returned by SingleEditCode.encode
+        """
+        val = np.asarray(getattr(codeword, "val", codeword))
+        record = b"".join(_encode_varint(int(v)) for v in (val.shape[0], n, N, l))
+        record += pack_2bit(val).tobytes()
+        self.file.write(record)
+        self.offsets.append(self.offsets[-1] + len(record))
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.write(np.asarray(self.offsets, dtype="<u8").tobytes())
+        self.file.seek(0)
+        self.file.write(_HEADER.pack(MAGIC, VERSION, self.q,
+                                     len(self.offsets) - 1, self.offsets[-1]))
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_archive(path, codewords, q=4):
+    """
+    codewords : iterable of (x_enc, n, N, l) tuples as returned by
+                SingleEditCode.encode, or of Frames
+    Return: number of codewords written
+    """
+    count = 0
+    with ArchiveWriter(path, q) as writer:
+        for item in codewords:
+            if isinstance(item, Frame):
+                item = item[1:]
+            writer.write(*item)
+            count += 1
+    return count
+
+def _batches(indices, batch_size):
+    batch = []
+    for i in indices:
+        batch.append(i)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class ArchiveReader:
+    """
+    Random access to a container file through a memory map. reader[i] is
+    the Frame of the i-th codeword, and iterating gives all Frames in order,
+    so a reader can be passed directly to stream.decode_stream.
+
+    Frames hold views of the map; use as a context manager, or call
+    close() once they are no longer needed.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = self._mmap
+        if len(buf) < _HEADER.size:
+            raise ValueError("Truncated codeword archive")
+        magic, version, self.q, self.count, index = _HEADER.unpack(buf[:_HEADER.size])
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a codeword archive of a supported version")
+        if len(buf) != index + 8 * (self.count + 1):
+            raise ValueError("Truncated codeword archive")
+        self.offsets = np.frombuffer(buf, dtype="<u8", count=self.count + 1, offset=index)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0: i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("Archive index out of range")
+        pos = int(self.offsets[i])
+        length, pos = _decode_varint(self._mmap, pos)
+        n, pos = _decode_varint(self._mmap, pos)
+        N, pos = _decode_varint(self._mmap, pos)
+        l, pos = _decode_varint(self._mmap, pos)
+        data = np.frombuffer(self._mmap, dtype=np.uint8, count=-(-length // 4), offset=pos)
+        return Frame(i, PackedQaryString.frombytes(self.q, data, length), n, N, l)
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def prefetch(self, indices):
+        """
+        Advise the kernel that the records at `indices` will be read soon, 
+        so that their pages are read in the background. No-op where 
+        madvise is unavailable. 
+        """
+        if not hasattr(self._mmap, "madvise"):
+            return
+        for i in indices:
+            start = int(self.offsets[i]) // mmap.PAGESIZE * mmap.PAGESIZE
+            self._mmap.madvise(mmap.MADV_WILLNEED, start, int(self.offsets[i+1]) - start)
+
+    def decode(self, code, indices=None, batch_size=1024, executor=None, depth=4):
+        """
+        Lazily decode the records at `indices`, batch_size at a time. The 
+        records of the next batches are prefetched while a batch decodes. 
+
+        code :      SingleEditCode, or SingleEditCodePool to decode each batch
+                    across its worker processes
+        indices :   iterable of record indices, defaults to all records
+        executor :  optional ThreadPoolExecutor that batches are submitted
+                    to when code is a SingleEditCode. A ProcessPoolExecutor
+                    is rejected, as it would pickle the code and its tables
+                    with every batch; pass a SingleEditCodePool as code 
+                    instead, whose workers set the code up once
+        depth :     number of batches in flight at a time
+        Yield: (index, message) in the order of `indices`, message being a 
+               numpy array or an ItemError if the record could not be decoded
+        """
+        if isinstance(executor, ProcessPoolExecutor):
+            raise Exception("ArchiveReader.decode() takes a thread executor; use a "
+                            "SingleEditCodePool as code to decode across processes")
+        if indices is None:
+            indices = range(self.count)
+        batches = _batches(indices, batch_size)
+        pending = deque()
+        batch = next(batches, None)
+        if batch is not None:
+            self.prefetch(batch)
+        while batch is not None:
+            current, batch = batch, next(batches, None)
+            if batch is not None:
+                self.prefetch(batch)
+            pending.append(self._submit(code, current, executor))
+            if len(pending) == depth:
+                yield from self._collect(*pending.popleft())
+        while pending:
+            yield from self._collect(*pending.popleft())
+
+    def _submit(self, code, batch, executor):
+        # Return the batch and a function that waits for its results
+        frames = [self[i] for i in batch]
+        args = ([f.codeword.val for f in frames], [f.n for f in frames],
+                [f.N for f in frames], [f.l for f in frames])
+        if isinstance(code, SingleEditCodePool):
+            return batch, code.decode_async(*args).get
+        if executor is not None:
+            return batch, executor.submit(decode_rows, code, *args).result
+        results = decode_rows(code, *args)
+        return batch, lambda: results
+
+    @staticmethod
+    def _collect(batch, results):
+        for i, message in zip(batch, results()):
+            if isinstance(message, ItemError):
+                # Report the record index rather than the position in batch
+                message = ItemError(i, message.message)
+            yield i, message
+
+    def close(self):
+        if self._mmap is not None:
+            self.offsets = None
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Frames still reference the map; it is released with them
+                pass
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Monte-Carlo simulation of a single-edit channel.
+
+Each codeword of a batch independently receives one substitution, one
+insertion or one deletion, with the given probabilities, or passes through
+unchanged. Errors are injected into the whole batch at once with numpy,
+from a seeded generator, and the received strings are decoded with
+SingleEditCode.decode, optionally across the processes of a
+SingleEditCodePool.
+"""
+
+from collections import namedtuple
+import numpy as np
+from .parallel import SingleEditCodePool, decode_timed
+
+ERROR_TYPES = ("none", "substitution", "insertion", "deletion")
+
+ChannelReport = namedtuple("ChannelReport", ["trials", "success_rate", "latency_us",
+                                             "trials_by_type", "failures_by_type"])
+ChannelReport.__doc__ = """
+Outcome of simulate().
+trials:             number of codewords sent
+success_rate:       fraction decoded to the original message, nan if no trials
+latency_us:         dict of percentile -> decode latency in microseconds, nan
+                    if no trials
+trials_by_type:     dict of error type -> number of codewords given that error
+failures_by_type:   dict of error type -> number of those not decoded
+"""
+
+def inject_errors(X, lengths, rates, rng, q=4):
+    """
+    Apply at most one edit to each row of a batch of codewords.
+
+    X :         2-D array, row i holding a codeword of length lengths[i]
+    rates :     dict of error type ("substitution", "insertion", "deletion")
+                -> probability that a codeword receives that error
+    rng :       numpy Generator, e.g. np.random.default_rng(seed)
+    Return: Y, a 2-D int8 array of the received strings zero-padded to
+            X.shape[1]+1 columns, their lengths, the index in ERROR_TYPES of
+            the error given to each row, and its 0-indexed position
+    """
+    X = np.asarray(X)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    B, W = X.shape
+    p = [rates.get(t, 0.0) for t in ERROR_TYPES[1:]]
+    if min(p) < 0 or sum(p) > 1:
+        raise Exception("Error rates must be non-negative and sum to at most 1")
+    types = rng.choice(4, size=B, p=[1 - sum(p)] + p)
+    # Empty strings can only receive insertions
+    types[(lengths == 0) & (types != 2)] = 0
+    ins, dele = types == 2, types == 3
+    positions = (rng.random(B) * (lengths + ins)).astype(np.int64)
+
+    # Received symbol j is sent symbol j, shifted by one after an insertion
+    # or from a deletion onwards
+    j = np.arange(W + 1)
+    src = j - (ins[:, None] & (j > positions[:, None])) + (dele[:, None] & (j >= positions[:, None]))
+    Y = np.take_along_axis(X, np.clip(src, 0, max(W - 1, 0)), axis=1).astype(np.int8) if W \
+        else np.zeros((B, 1), dtype=np.int8)
+    received = lengths + ins - dele
+    Y[j >= received[:, None]] = 0
+
+    rows = np.flatnonzero(ins)
+    Y[rows, positions[rows]] = rng.integers(0, q, size=rows.shape[0])
+    rows = np.flatnonzero(types == 1)
+    Y[rows, positions[rows]] = (X[rows, positions[rows]] + rng.integers(1, q, size=rows.shape[0])) % q
+    return Y, received, types, positions
+
+def simulate(code, length, trials, rates, seed=None, batch_size=4096,
+             percentiles=(50, 90, 99, 99.9)):
+    """
+    Send random messages of the given length through the channel and
+    decode them.
+
+    code :          SingleEditCode, or SingleEditCodePool to encode and
+                    decode across its worker processes
+    length :        message length l
+    trials :        number of messages
+    rates :         see inject_errors
+    seed :          seed of the generator for messages and errors
+    batch_size :    number of messages encoded and sent at a time
+    Return: ChannelReport
+    """
+    if trials == 0:
+        return ChannelReport(0, float("nan"), {p: float("nan") for p in percentiles},
+                             {t: 0 for t in ERROR_TYPES}, {t: 0 for t in ERROR_TYPES})
+    rng = np.random.default_rng(seed)
+    types_all, ok_all, times_all = [], [], []
+    for start in range(0, trials, batch_size):
+        messages = rng.integers(0, 4, size=(min(batch_size, trials - start), length))
+        X, n, N, l = _encode(code, messages)
+        Y, received, types, positions = inject_errors(X, N, rates, rng)
+        rows = [Y[i, :received[i]] for i in range(Y.shape[0])]
+        if isinstance(code, SingleEditCodePool):
+            decoded, times = code.decode_timed(rows, n, N, l)
+        else:
+            decoded, times = decode_timed(code, rows, n, N, l)
+        ok = [d is not None and d.shape[0] == length and np.all(d == m)
+              for d, m in zip(decoded, messages)]
+        types_all.append(types)
+        ok_all.append(np.array(ok, dtype=bool))
+        times_all.append(np.array(times))
+
+    types, ok, times = (np.concatenate(v) for v in (types_all, ok_all, times_all))
+    latency = np.percentile(times * 1e6, percentiles)
+    return ChannelReport(
+        trials, float(ok.mean()),
+        dict(zip(percentiles, (float(t) for t in latency))),
+        {t: int(np.count_nonzero(types == i)) for i, t in enumerate(ERROR_TYPES)},
+        {t: int(np.count_nonzero((types == i) & ~ok)) for i, t in enumerate(ERROR_TYPES)})
+
+def _encode(code, messages):
+    if not isinstance(code, SingleEditCodePool):
+        return code.encode_batch(messages)
+    results = code.encode(messages)
+    for r in results:
+        if isinstance(r, Exception):
+            raise r
+    N = np.array([r[2] for r in results], dtype=np.int64)
+    X = np.zeros((len(results), N.max(initial=0)), dtype=np.int8)
+    for i, r in enumerate(results):
+        X[i, :N[i]] = r[0]
+    return (X, np.array([r[1] for r in results], dtype=np.int64), N,
+            np.array([r[3] for r in results], dtype=np.int64))
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Process pool front end for SingleEditCode.
+
+The parent process builds (or loads) the sum-balanced code's tables once
+and places them in shared memory; every worker maps the same copy.
+"""
+
+import gc
+import multiprocessing
+import multiprocessing.util
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from .single_edit_code import SingleEditCode
+from .qary_string import QaryString
+from . import table_cache
+
+class ItemError(Exception):
+    """
+    Failure to encode or decode one item of a batch. Returned in place of
+    that item's result instead of being raised.
+    """
+    def __init__(self, index, message):
+        super().__init__(index, message)
+        self.index = index
+        self.message = message
+
+    def __str__(self):
+        return f"item {self.index}: {self.message}"
+
+# Per-worker state, set up by _init_worker
+_code = None
+_shm = None
+
+def _init_worker(k, name, size, whiten, fixed_length):
+    global _code, _shm
+    _shm = shared_memory.SharedMemory(name=name)
+    _code = SingleEditCode(k, tables=_shm.buf[:size], fixed_length=fixed_length, whiten=whiten)
+    multiprocessing.util.Finalize(None, _close_worker, exitpriority=10)
+
+def _close_worker():
+    # The code's tables are views of the shared memory, which cannot be
+    # closed while they exist
+    global _code, _shm
+    _code = None
+    gc.collect()
+    _shm.close()
+    _shm = None
+
+def _encode_chunk(chunk):
+    start, rows = chunk
+    try:
+        X_enc, n, N, l = _code.encode_batch(rows)
+        return [(X_enc[i, :N[i]], n[i], N[i], l[i]) for i in range(len(rows))]
+    except Exception:
+        pass
+    # Something in the chunk failed; redo it item by item
+    results = []
+    for i, row in enumerate(rows):
+        try:
+            x_enc, n, N, l = _code.encode(QaryString(4, row))
+            results.append((x_enc.val, n, N, l))
+        except Exception as e:
+            results.append(ItemError(start + i, f"{type(e).__name__}: {e}"))
+    return results
+
+def decode_rows(code, rows, n, N, l, start=0):
+    """
+    Decode a batch with code.decode_batch, falling back to one item at a 
+    time if it fails. 
+    rows :      list of received strings as 1-D arrays
+    start :     index of the first row, for reporting errors
+    Return: list of decoded messages as numpy arrays, or ItemError for 
+            strings that could not be decoded
+    """
+    try:
+        X_dec, l = code.decode_batch(rows, n, N, l)
+        return [X_dec[i, :l[i]] for i in range(len(rows))]
+    except Exception:
+        pass
+    results = []
+    for i, row in enumerate(rows):
+        try:
+            results.append(code.decode(QaryString(4, row), n[i], N[i], l[i]).val)
+        except Exception as e:
+            results.append(ItemError(start + i, f"{type(e).__name__}: {e}"))
+    return results
+
+def decode_timed(code, rows, n, N, l):
+    """
+    Decode each row with code.decode, timing each call
+    Return: list of decoded messages as numpy arrays, or None for strings
+            that could not be decoded, and a list of the times in seconds
+    """
+    results, times = [], []
+    for i, row in enumerate(rows):
+        start = time.perf_counter()
+        try:
+            results.append(code.decode(QaryString(4, row), n[i], N[i], l[i]).val)
+        except Exception:
+            results.append(None)
+        times.append(time.perf_counter() - start)
+    return results, times
+
+def _decode_chunk(chunk):
+    return decode_rows(_code, *chunk[1:], start=chunk[0])
+
+def _decode_timed_chunk(chunk):
+    return decode_timed(_code, *chunk[1:])
+
+class _FlatResult:
+    """
+    AsyncResult of a map over chunks, flattened to a list of items on get()
+    """
+    def __init__(self, result):
+        self.result = result
+
+    def get(self):
+        return [r for rs in self.result.get() for r in rs]
+
+class SingleEditCodePool:
+    """
+    Encodes and decodes batches with a SingleEditCode sharded across worker
+    processes. Results are returned in input order; an item that fails is
+    reported as an ItemError in its slot without failing the batch.
+
+    Use as a context manager, or call close() when done.
+    """
+    def __init__(self, k: int = 64, processes=None, cache_dir=None, chunksize=None,
+                 whiten=False, mp_context=None, fixed_length=False):
+        """
+        k :         Window length of the sum-balanced code
+        processes : Number of worker processes, defaults to the CPU count
+        cache_dir : Optional table cache directory, see SumBalancedCode
+        chunksize : Number of items per task, defaults to splitting each
+                    batch into roughly 4 tasks per worker
+        whiten :    Whiten messages before sum-balancing, see SumBalancedCode
+        mp_context: Optional multiprocessing context to start the workers
+                    with, e.g. multiprocessing.get_context("spawn")
+        fixed_length: Encode in fixed-length mode, see SingleEditCode, so
+                    that self.code.decode_fixed needs only the message length
+        """
+        self.code = SingleEditCode(k, cache_dir=cache_dir, fixed_length=fixed_length,
+                                   whiten=whiten)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunksize = chunksize
+        tables = table_cache.dump_buckets(self.code.sbcode)
+        self._shm = shared_memory.SharedMemory(create=True, size=len(tables))
+        try:
+            self._shm.buf[:len(tables)] = tables
+            self._pool = (mp_context or multiprocessing).Pool(
+                self.processes, initializer=_init_worker,
+                initargs=(k, self._shm.name, len(tables), whiten, fixed_length))
+        except BaseException:
+            # Nothing else will release the block
+            self._shm.close()
+            self._shm.unlink()
+            raise
+
+    def _chunks(self, count):
+        size = self.chunksize or max(1, -(-count // (4 * self.processes)))
+        return [(i, min(i + size, count)) for i in range(0, count, size)]
+
+    def _decode_chunks(self, codewords, n, N, l):
+        codewords = [np.asarray(c) for c in codewords]
+        n, N, l = (np.asarray(v, dtype=np.int64) for v in (n, N, l))
+        return [(i, codewords[i:j], n[i:j], N[i:j], l[i:j])
+                for i, j in self._chunks(len(codewords))]
+
+    def encode(self, messages):
+        """
+        messages :  2-D array of quaternary messages or a list of 1-D arrays
+        Return: list of (x_enc, n, N, l) tuples, x_enc a numpy array, or
+                ItemError for messages that could not be encoded
+        """
+        messages = [np.asarray(m) for m in messages]
+        chunks = [(i, messages[i:j]) for i, j in self._chunks(len(messages))]
+        return [r for rs in self._pool.map(_encode_chunk, chunks, chunksize=1) for r in rs]
+
+    def decode(self, codewords, n, N, l):
+        """
+        codewords : list of received strings as 1-D arrays
+        n, N, l :   sequences of the quantities returned by encode
+        Return: list of decoded messages as numpy arrays, or ItemError for
+                strings that could not be decoded
+        """
+        return self.decode_async(codewords, n, N, l).get()
+
+    def decode_async(self, codewords, n, N, l):
+        """
+        As decode, but return at once with an object whose get() method 
+        waits for and returns the results
+        """
+        chunks = self._decode_chunks(codewords, n, N, l)
+        return _FlatResult(self._pool.map_async(_decode_chunk, chunks, chunksize=1))
+
+    def decode_timed(self, codewords, n, N, l):
+        """
+        As decode_timed() across the worker processes, in input order
+        """
+        chunks = self._decode_chunks(codewords, n, N, l)
+        results, times = [], []
+        for rs, ts in self._pool.map(_decode_timed_chunk, chunks, chunksize=1):
+            results += rs
+            times += ts
+        return results, times
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            self._shm.close()
+            self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -7,8 +7,11 @@ Created on Sat Feb  8 00:55:22 2020
 
 import numpy as np
 from .util import syndrome, signature, parity_check, is_sum_balanced
+from .util import pack_2bit, unpack_2bit, packed_sum, packed_syndrome, packed_signature
+from .util import int_from_digits, int_to_digits
 
 class QaryString:
+    __slots__ = ("q", "val")
     
     def __init__(self, q : int = 4, 
                        val = np.zeros(shape=0, dtype=np.int8)):
@@ -19,6 +22,29 @@ class QaryString:
             val = np.array(val)
         self.val = val.astype(np.int8)
         
+    @classmethod
+    def _wrap(cls, q, val):
+        # Take ownership of a new int8 array without copying it
+        qstr = cls.__new__(cls)
+        qstr.q = q
+        qstr.val = val
+        return qstr
+    
+    def _like(self, val, q=None):
+        # String built by an operation on this one, from a new array
+        return QaryString._wrap(self.q if q is None else q, val.astype(np.int8, copy=False))
+    
+    def __getstate__(self):
+        # A dict of attributes, as pickled before __slots__ was added
+        return {"q": self.q, "val": self.val}
+    
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            # (__dict__, slots) from the default state of slotted objects
+            state = {**(state[0] or {}), **state[1]}
+        for name, value in state.items():
+            setattr(self, name, value)
+        
     """
     Core methods
     """
@@ -28,26 +54,18 @@ class QaryString:
         return self.val.shape[0]
         
     def concatenate(self, qstrs):
-        val = np.copy(self.val)
+        vals = [self.val]
         for qstr in qstrs:
             assert self.q == qstr.q
-            val = np.concatenate([val, qstr.val])
-        return QaryString(self.q, val)
+            vals.append(qstr.val)
+        return self._like(np.concatenate(vals))
     
     def asint(self):
-        sum = 0
-        for i in range(len(self)):
-            sum = sum * self.q
-            sum += int(self.val[i])
-        return sum
+        return int_from_digits(self.val, self.q)
     
     def fromint(self, n: int):
-        vals = []
-        while n > 0:
-            vals.append(n % 4)
-            n = n // 4
-        vals = vals[::-1]
-        return QaryString(self.q, val=np.array(vals))
+        # Shortest base-q representation; empty for n = 0
+        return self._like(int_to_digits(n, self.q))
     
 
     
@@ -87,6 +105,15 @@ class QaryString:
             idx = idx + l
         return tuple(parts)
     
+    def pack(self):
+        """
+        Return a copy of this string stored four symbols to a byte
+        """
+        return PackedQaryString(self.q, self.val)
+    
+    def unpack(self):
+        return QaryString(self.q, self.val)
+    
     def randomize(self, n):
         return QaryString(self.q, np.random.randint(low=0, high=self.q, size=n))
         
@@ -138,16 +165,16 @@ class QaryString:
         idx_of_pos: If 1, pos is 1-indexed. If 0, pos is 0-indexed.  
         """
         val = np.insert(self.val, pos-idx_of_pos, symbol)
-        return QaryString(self.q, val)
+        return self._like(val)
     
     def _delete(self, pos, idx_of_pos=0):
         val = np.delete(self.val, pos-idx_of_pos)
-        return QaryString(self.q, val)
+        return self._like(val)
     
     def _substitute(self, pos, symbol, idx_of_pos=0):
         val = np.copy(self.val)
         val[pos-idx_of_pos] = symbol
-        return QaryString(self.q, val)
+        return self._like(val)
     
     @property
     def syndrome(self):
@@ -155,7 +182,7 @@ class QaryString:
     
     @property
     def signature(self):
-        return QaryString(q=2, val=signature(self.val))
+        return self._like(signature(self.val), q=2)
     
     @property
     def parity_check(self):
@@ -181,15 +208,132 @@ class QaryString:
     
     @property
     def as_binary_matrix(self):
-        logq = np.ceil(np.log(self.q) / np.log(2)).astype(self.val.dtype)
-        m = np.zeros([self.length, logq], dtype=self.val.dtype)
-        for i in range(self.length):
-            binary = list(bin(self.val[i])[2:])
-            binary = [0] * (logq - len(binary)) + binary            
-            m[i,:] = np.array(binary)
-        return self.q, m
+        # Bit planes, most significant bit first
+        logq = int(np.ceil(np.log(self.q) / np.log(2)))
+        shifts = np.arange(logq - 1, -1, -1, dtype=self.val.dtype)
+        return self.q, (self.val[:, None] >> shifts) & 1
     
     @staticmethod
     def from_binary_matrix(q, m):
-        val = [QaryString(2, m[i]).asint() for i in range(m.shape[0])]
-        return QaryString(q, val)
\ No newline at end of file
+        m = np.asarray(m)
+        weights = 1 << np.arange(m.shape[1] - 1, -1, -1)
+        return QaryString(q, m.astype(np.int64) @ weights)
+
+class QaryView(QaryString):
+    """
+    QaryString that shares memory instead of copying. An int8 array passed
+    in is used as is, and other dtypes are converted once. Slicing returns
+    a zero-copy view, and operations that build new strings (concatenate,
+    _insert, ...) return QaryViews of their new arrays.
+
+    Mutation is copy-on-write: `val` is read-only whenever it may be shared
+    with another string or with the array passed in, and x[i] = v copies it
+    first.
+    """
+    __slots__ = ()
+
+    def __init__(self, q : int = 4,
+                       val = np.zeros(shape=0, dtype=np.int8)):
+        self.q = q
+        val = np.asarray(val)
+        if val.dtype != np.int8:
+            val = val.astype(np.int8)
+        else:
+            val = val.view()
+            val.flags.writeable = False
+        self.val = val.reshape(1) if val.ndim == 0 else val
+
+    def _like(self, val, q=None):
+        return QaryView._wrap(self.q if q is None else q, val.astype(np.int8, copy=False))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            # Both strings now share the array
+            self.val.flags.writeable = False
+        return QaryView(self.q, self.val[key])
+
+    def __setitem__(self, key, item):
+        if not self.val.flags.writeable:
+            self.val = self.val.copy()
+        self.val[key] = item
+
+class PackedQaryString(QaryString):
+    """
+    QaryString with q <= 4 stored as 2 bits per symbol. 
+    
+    `val` unpacks on every access, so all QaryString methods work unchanged;
+    length, slicing, split, sum, syndrome and signature work on the packed
+    bytes directly. Operations that build new strings (concatenate, 
+    _insert, ...) return ordinary QaryStrings. 
+    """
+    
+    def __init__(self, q : int = 4, 
+                       val = np.zeros(shape=0, dtype=np.int8)):
+        if q > 4:
+            raise Exception("PackedQaryString requires q <= 4")
+        super().__init__(q, val)
+        
+    @classmethod
+    def frombytes(cls, q, data, n):
+        """
+        Wrap 2-bit packed data holding n symbols, without copying
+        """
+        qstr = cls.__new__(cls)
+        qstr.q = q
+        qstr.data = data
+        qstr.n = n
+        return qstr
+        
+    @property
+    def val(self):
+        return unpack_2bit(self.data, self.n)
+    
+    @val.setter
+    def val(self, val):
+        self.data = pack_2bit(val)
+        self.n = val.shape[0]
+        
+    @property
+    def length(self):
+        return self.n
+    
+    def __getstate__(self):
+        return {"q": self.q, "data": self.data, "n": self.n}
+    
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return QaryString(self.q, self.val.__getitem__(key))
+        start, stop, step = key.indices(self.n)
+        if step != 1:
+            return PackedQaryString(self.q, self.val.__getitem__(key))
+        stop = max(start, stop)
+        if start % 4 != 0:
+            # Unaligned; repack the symbols from the covering bytes
+            first = start // 4
+            val = unpack_2bit(self.data[first:-(-stop // 4)], stop - 4*first)
+            return PackedQaryString(self.q, val[start - 4*first:])
+        data = self.data[start // 4:-(-stop // 4)].copy()
+        if stop % 4 != 0:
+            # Clear the bits past the end of the slice
+            data[-1] &= (0xff00 >> (2 * (stop % 4))) & 0xff
+        return PackedQaryString.frombytes(self.q, data, stop - start)
+    
+    def __setitem__(self, key, item):
+        val = self.val
+        val.__setitem__(key, item)
+        self.val = val
+        
+    def __str__(self):
+        return f"q = {self.q}, packed, val = {self.val}"
+    
+    @property
+    def syndrome(self):
+        return packed_syndrome(self.data)
+    
+    @property
+    def signature(self):
+        return QaryString(q=2, val=packed_signature(self.data, self.n))
+    
+    @property
+    def sum(self):
+        return packed_sum(self.data)
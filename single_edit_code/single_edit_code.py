@@ -6,17 +6,213 @@ Created on Tue Feb  4 23:28:57 2020
 """
 
 import numpy as np
-from .qary_string import QaryString
+from collections import namedtuple
+from .qary_string import QaryString, QaryView
 from .svt_code import SVTCode
 from .sum_balanced_code import SumBalancedCode
+from .util import to_digits, from_digits, small_inverses, checksums, checksums_batch
+from . import stats
 from typing import List
 
+LengthPlan = namedtuple("LengthPlan", ["l", "n_lower", "n_max", "N_lower", "N_max"])
+LengthPlan.__doc__ = """
+Bounds on the lengths produced by SingleEditCode.encode for messages of 
+length l, over all such messages. 
+n_lower, n_max: length of the sum-balanced intermediate
+N_lower, N_max: codeword length
+n_max and N_max are the largest lengths. n_lower and N_lower are loose 
+lower bounds, usually well below the lengths actually reached, see 
+SumBalancedCode.length_bounds. 
+"""
+
+def _as_rows(X, lengths=None):
+    """
+    Normalize a batch to a list of 1-D arrays. X is either a 2-D array, 
+    whose rows are truncated to `lengths` if given, or a list of 1-D arrays. 
+    """
+    if isinstance(X, np.ndarray) and X.ndim == 2:
+        if lengths is None:
+            return list(X)
+        return [row[:length] for row, length in zip(X, lengths)]
+    return [np.asarray(row) for row in X]
+
+def _stack_rows(rows, width=None):
+    """
+    Stack 1-D arrays into a zero-padded 2-D int8 array
+    """
+    lengths = np.array([len(row) for row in rows], dtype=np.int64)
+    if width is None:
+        width = lengths.max() if len(rows) else 0
+    out = np.zeros((len(rows), width), dtype=np.int8)
+    for i, row in enumerate(rows):
+        out[i, :len(row)] = row
+    return out
+
+def _observe_candidates(kind, Js, windows):
+    """
+    Record |Js| and |Jp|, the number of signature positions in the union of
+    the windows (lo, hi) of possible edit locations, in the enabled Stats
+    """
+    rec = stats.active()
+    if rec is not None:
+        rec.observe(kind + ".Js", len(Js))
+        size, end = 0, None
+        for lo, hi in sorted(windows):
+            if end is not None:
+                lo = max(lo, end + 1)
+            if lo <= hi:
+                size += hi - lo + 1
+                end = hi
+        rec.observe(kind + ".Jp", size)
+
+def _runs(s):
+    """
+    Run structure of a binary array s of length m, as two int arrays:
+    nxt[i]: smallest i' >= i with 1 <= i' < m and s[i'] != s[i'-1], else m
+    prv[i]: largest i' <= i with 1 <= i' < m and s[i'] != s[i'-1], else 0
+    """
+    m = s.shape[0]
+    idx = np.arange(m + 1)
+    change = np.zeros(m + 1, dtype=bool)
+    change[1:m] = s[1:] != s[:-1]
+    nxt = np.minimum.accumulate(np.where(change, idx, m)[::-1])[::-1]
+    prv = np.maximum.accumulate(np.where(change, idx, 0))
+    # Only a few entries are read per candidate, so these stay numpy arrays
+    return nxt, prv
+
+def _common_prefix(x, y):
+    m = min(x.shape[0], y.shape[0])
+    diff = np.flatnonzero(x[:m] != y[:m])
+    return int(diff[0]) if diff.shape[0] else m
+
+def _common_suffix(x, y):
+    return _common_prefix(x[::-1], y[::-1])
+
+def _deletion_patch(xv, sym, p):
+    """
+    Signature bits of xv with sym inserted at 0-indexed position p that 
+    differ from the signature of xv: {index: bit}
+    """
+    patch = {}
+    if p >= 1: patch[p-1] = int(sym >= xv[p-1])
+    if p < xv.shape[0]: patch[p] = int(xv[p] >= sym)
+    return patch
+
+def _deletion_window(t, runs, patch, p):
+    """
+    Deletion decoder: t is the signature of xp, and s (length m) that of xp
+    with a symbol inserted at 0-indexed p, i.e. s[i] = t[i] for i < p-1, 
+    s[i] = patch[i] for p-1 <= i <= p, s[i] = t[i-1] for i > p. 
+    Return (lo, hi) such that deleting 1-indexed position jp of s gives t
+    iff lo <= jp <= hi. 
+    """
+    nxt, prv = runs
+    m = t.shape[0] + 1
+    a = max(p-1, 0)
+    # Common prefix of s and t
+    lcp = None
+    for i in range(a, min(p, m-1)+1):
+        if i >= m-1:
+            lcp = m-1
+            break
+        if patch[i] != t[i]:
+            lcp = i
+            break
+    if lcp is None:
+        lcp = int(nxt[p+1])
+    # Common suffix of s and t. stop is the last index of s not matched
+    stop = None
+    for i in range(min(p, m-1), a-1, -1):
+        if i == 0 or patch[i] != t[i-1]:
+            stop = i
+            break
+    if stop is None:
+        stop = int(prv[a-1])
+    lcs = m-1-stop
+    return max(1, m-lcs), min(m, lcp+1)
+
+def _insertion_patch(xv, p):
+    """
+    Signature bit of xv with 0-indexed position p removed that is not a bit
+    of the signature of xv: {index: bit}
+    """
+    if 1 <= p < xv.shape[0] - 1:
+        return {p-1: int(xv[p+1] >= xv[p-1])}
+    return {}
+
+def _insertion_window(s, runs, patch, p):
+    """
+    Insertion decoder: s (length m) is the signature of xp, and t that of
+    xp with 0-indexed position p removed, i.e. t[i] = s[i] for i < p-1, 
+    t[p-1] = patch[p-1], t[i] = s[i+1] for i >= p. 
+    Return (lo, hi) such that deleting 1-indexed position jp of s gives t
+    iff lo <= jp <= hi. 
+    """
+    nxt, prv = runs
+    m = s.shape[0]
+    # Common prefix of s and t
+    if p-1 >= m-1:
+        lcp = m-1
+    elif p >= 1 and patch[p-1] != s[p-1]:
+        lcp = p-1
+    else:
+        lcp = int(nxt[p+1]) - 1
+    # Common suffix of s and t. stop is the last index of t not matched
+    if p == 0:
+        stop = -1
+    elif p-1 <= m-2 and patch[p-1] != s[p]:
+        stop = p-1
+    else:
+        stop = int(prv[p-1]) - 1
+    lcs = m-2-stop
+    return max(1, m-lcs), min(m, lcp+1)
+
 class SingleEditCode:
-    def __init__(self, k: int = 64):
+    def __init__(self, k: int = 64, cache_dir=None, tables=None, fixed_length=False,
+                 whiten=False):
+        """
+        k :             Window length of the sum-balanced code
+        cache_dir :     Optional directory for caching the sum-balanced code's
+                        precomputed tables across processes, see SumBalancedCode
+        tables :        Optional buffer of serialized precomputed tables, see 
+                        SumBalancedCode
+        fixed_length :  Encode every message of length l to a codeword of 
+                        length plan(l).N_max, so that decode_fixed needs only l
+        whiten :        Whiten messages with a fixed keystream before 
+                        sum-balancing, so that low-entropy messages rarely 
+                        need forbidden-word replacements, see SumBalancedCode
+        """
         if type(k) is not int:
             raise Exception("SingleEditCode requires integer k")
         self.k = k
-        self.sbcode = SumBalancedCode(k)
+        self.fixed_length = fixed_length
+        self.sbcode = SumBalancedCode(k, cache_dir=cache_dir, tables=tables, 
+                                      fixed_length=fixed_length, whiten=whiten)
+
+    def codeword_length(self, n):
+        """
+        Length N of the codeword for a sum-balanced intermediate of length n
+        """
+        bitlen = QaryString().bitlen
+        return n + 2 + bitlen(4*n + 1) + bitlen(self._get_P(n)) + 1 + 2
+
+    def plan(self, l):
+        """
+        Bounds on n and N for messages of length l, computed without encoding.
+        Raises if the replacement blocks of the sum-balanced code are longer
+        than k, e.g. for k = 64 and l > 256, as n is then not bounded. 
+        Return: LengthPlan
+        """
+        n_lower, n_max = self.sbcode.length_bounds(l)
+        return LengthPlan(l, n_lower, n_max, self.codeword_length(n_lower), 
+                          self.codeword_length(n_max))
+
+    def plan_table(self, lengths):
+        """
+        lengths : iterable of message lengths, e.g. range(100, 200)
+        Return: dict mapping each length l to plan(l)
+        """
+        return {l: self.plan(l) for l in lengths}
 
     def encode(self, x):
         """
@@ -32,7 +228,8 @@ class SingleEditCode:
         l :             length of x
         """
 
-        x, l = self.sbcode.encode(x)
+        with stats.stage("sum_balance"):
+            x, l = self.sbcode.encode(x)
         x_enc = None
         n = x.length
 
@@ -40,10 +237,10 @@ class SingleEditCode:
         P = 20*k
 
 
-        a = x.syndrome % (4*n + 1)
-        b = x.signature.syndrome % P
-        c = x.signature.parity_check
-        d = x.sum % 7
+        with stats.stage("checksums"):
+            a, b, c, d = checksums(x.val, P)
+        a %= 4*n + 1
+        d %= 7
         M = x.marker
 
         R1 = x.fromint(a).pad_to(x.bitlen(4*n+1))
@@ -54,6 +251,118 @@ class SingleEditCode:
         x_enc = x.concatenate([M, R1, R2, R3, R4])
         return x_enc, n, x_enc.length, l
 
+    def encode_batch(self, X, lengths=None):
+        """
+        Encode many messages at once. The checksums are computed for the
+        whole batch with numpy. 
+        
+        Parameters
+        ----------
+        X :         2-D array of quaternary messages, one per row, or a list
+                    of 1-D arrays of varying length
+        lengths :   optional lengths of the rows of a 2-D X
+        
+        Returns
+        -------
+        X_enc :     2-D int8 array, row i holding codeword i zero-padded
+        n, N, l :   int arrays of the parameters returned by encode
+        """
+        rows = _as_rows(X, lengths)
+        with stats.stage("sum_balance"):
+            xs = [self.sbcode.encode(QaryView(4, row))[0].val for row in rows]
+        l = np.array([len(row) for row in rows], dtype=np.int64)
+        n = np.array([len(x) for x in xs], dtype=np.int64)
+        
+        encoded = [None] * len(xs)
+        for nn in np.unique(n).tolist():
+            idx = np.flatnonzero(n == nn)
+            P = self._get_P(nn)
+            Xg = np.stack([xs[i] for i in idx])
+            with stats.stage("checksums"):
+                a, b, c, d = checksums_batch(Xg, P)
+            m = (Xg[:, -1] == 0).astype(np.int64)
+            x_enc = np.concatenate([
+                Xg,
+                np.stack([m, m], axis=1),
+                to_digits(a % (4*nn + 1), QaryString().bitlen(4*nn + 1)),
+                to_digits(b, QaryString().bitlen(P)),
+                to_digits(c, 1),
+                to_digits(d % 7, 2)
+            ], axis=1)
+            for i, row in zip(idx, x_enc):
+                encoded[i] = row
+        N = np.array([len(x) for x in encoded], dtype=np.int64)
+        return _stack_rows(encoded), n, N, l
+    
+    def decode_batch(self, X_enc, n, N, l, lengths=None):
+        """
+        Decode many codewords at once. Received strings with no error in 
+        the sum-balanced part are detected for the whole batch with numpy. 
+        
+        Parameters
+        ----------
+        X_enc :     2-D array of received strings, one per row, or a list of 
+                    1-D arrays
+        lengths :   lengths of the rows of a 2-D X_enc. Required for a 2-D
+                    X_enc unless every row has length N, and ValueError
+                    is raised if it is missing. 
+        n, N, l :   arrays of the quantities returned by encode_batch
+        
+        Returns
+        -------
+        X_dec :     2-D int8 array, row i holding message i zero-padded
+        l :         int array of message lengths
+        """
+        n, N, l = (np.asarray(v, dtype=np.int64) for v in (n, N, l))
+        if isinstance(X_enc, np.ndarray) and X_enc.ndim == 2 and lengths is None \
+                and np.any(N != X_enc.shape[1]):
+            # Padded rows would be decoded as if they carried an edit
+            raise ValueError("decode_batch() requires lengths for a 2-D X_enc "
+                             "whose rows do not all have length N")
+        rows = _as_rows(X_enc, lengths)
+        received = np.array([len(row) for row in rows], dtype=np.int64)
+        decoded = [None] * len(rows)
+        
+        # Unmutated strings and substitutions outside the sum-balanced part
+        for nn, NN in set(zip(n[received == N].tolist(), N[received == N].tolist())):
+            idx = np.flatnonzero((n == nn) & (N == NN) & (received == N))
+            Yg = np.stack([rows[i] for i in idx]).astype(np.int64)
+            xp, Mp = Yg[:, :nn], Yg[:, nn:nn+2]
+            w1 = QaryString().bitlen(4*nn + 1)
+            R1p = from_digits(Yg[:, nn+2:nn+2+w1])
+            R4p = from_digits(Yg[:, -2:])
+            ap, _, _, dp = checksums_batch(xp)
+            ap %= 4*nn + 1
+            dp %= 7
+            clean = (Mp[:, 0] != Mp[:, 1]) | (R4p == dp) | (R1p == ap)
+            for i, x in zip(idx[clean], xp[clean]):
+                decoded[i] = QaryView(4, x)
+                
+        for i, row in enumerate(rows):
+            if decoded[i] is None:
+                x_enc = QaryView(4, row)
+                if x_enc.length == N[i]:
+                    decoded[i] = self._decode_substitution(x_enc, n[i], False)
+                elif x_enc.length == N[i]+1:
+                    decoded[i] = self._decode_insertion(x_enc, n[i], False)
+                elif x_enc.length == N[i]-1:
+                    decoded[i] = self._decode_deletion(x_enc, n[i], False)
+                else:
+                    raise Exception(f"Row {i} has invalid length in decode_batch()")
+            with stats.stage("unbalance"):
+                decoded[i] = self.sbcode.decode(decoded[i], l[i]).val
+        return _stack_rows(decoded), l
+
+    def decode_fixed(self, x_enc, l, verbose=False):
+        """
+        Decode a codeword of a fixed-length code given only the message 
+        length l. See decode. 
+        """
+        if not self.fixed_length:
+            raise Exception("decode_fixed() requires a SingleEditCode with fixed_length=True")
+        n = l + 1
+        return self.decode(x_enc, n, self.codeword_length(n), l, verbose)
+
     def decode(self, x_enc, n, N, l, verbose=False):
         """
         Parameters
@@ -65,8 +374,10 @@ class SingleEditCode:
         -------
         x_dec :         Decoded QaryString of length (l)
         """
-        if verbose: print("Beginning decoding...")
+        stats.event(verbose, "decode", length=x_enc.length, n=n, N=N, l=l)
         assert N-1 <= x_enc.length <= N+1
+        # Split and sliced without copying
+        x_enc = QaryView(x_enc.q, x_enc.val)
         if x_enc.length == N:
             x_dec_ksumbalanced = self._decode_substitution(x_enc, n, verbose)
         elif x_enc.length == N+1:
@@ -75,7 +386,8 @@ class SingleEditCode:
             x_dec_ksumbalanced = self._decode_deletion(x_enc, n, verbose)
         else:
             raise Exception("x_enc has invalid length in decode()")
-        return self.sbcode.decode(x_dec_ksumbalanced, l)
+        with stats.stage("unbalance"):
+            return self.sbcode.decode(x_dec_ksumbalanced, l)
 
 
     def _decode_substitution(self, x_enc, n, verbose):
@@ -86,121 +398,150 @@ class SingleEditCode:
         if Mp[0] != Mp[1]:
             return xp
 
-        ap = xp.syndrome % (4*n + 1)
-        dp = xp.sum % 7
+        with stats.stage("checksums"):
+            ap, _, _, dp = checksums(xp.val)
+        ap %= 4*n + 1
+        dp %= 7
 
         if R4p.asint() == dp:
             return xp
         if R1p.asint() == ap:
             return xp
-        val_change = dp - R4p.asint()
+        val_change = int(dp) - R4p.asint()
         if val_change <= -x_enc.q: val_change += 7
         if val_change >= x_enc.q: val_change -= 7
-        sig_change = ap - R1p.asint()
-        for j in range(1, n+1):
-            if (sig_change - j * val_change) % (4*n+1) == 0:
-                break
-            if j == n:
-                raise Exception("j not found")
-
-        if verbose:
-            print(f"Detected a substitution at array index {j-1}")
-            print(f"Increase in value: {val_change}")
-
-        x = QaryString(xp.q, xp.val)
-        x.val[j-1] = x.val[j-1] - val_change
-        return x
+        sig_change = int(ap) - R1p.asint()
+        # The substitution is at the smallest j >= 1 with 
+        # j*val_change = sig_change (mod 4n+1)
+        inverses = small_inverses(4*n+1, x_enc.q)
+        if val_change not in inverses:
+            # More than one error, e.g. in R4 as well
+            raise Exception("j not found")
+        g, inv = inverses[val_change]
+        if sig_change % g != 0:
+            raise Exception("j not found")
+        j = (sig_change // g) * inv % ((4*n+1) // g)
+        if j == 0: j = (4*n+1) // g
+        if j > n:
+            raise Exception("j not found")
+
+        stats.event(verbose, "substitution", index=j-1, change=val_change)
+
+        return xp._substitute(j-1, xp.val[j-1] - val_change)
 
     def _decode_deletion(self, x_enc, n, verbose):
-        if verbose:
-            print("Deletion detected.")
-            print("Computing parameters...")
         P = self._get_P(n)
         lengths = [n-1, 2, x_enc.bitlen(4*n+1), x_enc.bitlen(P), 1, 2]
         xp, Mp, R1p, R2p, R3p, R4p = x_enc.split(lengths)
         if Mp[0] != Mp[1]:
             return xp.concatenate(Mp[0])
 
-        ap = xp.syndrome % (4*n + 1)
-        cp = xp.signature.parity_check
-        dp = xp.sum % 7
+        xv = xp.val.astype(np.int64)
+        t = np.empty(max(n-2, 0), dtype=np.int8)
+        with stats.stage("checksums"):
+            ap, _, cp, dp = checksums(xv, sig=t)
+        ap %= 4*n + 1
+        dp %= 7
 
         xp_deleted_symbol = (R4p.asint() - dp) % 7
-        if verbose: print(f"Deletion of symbol {xp_deleted_symbol} detected.")
 
-        Js = []
+        M = 4*n + 1
+        sym = int(xp_deleted_symbol)
+        # suffix[j-1] = xp[j-1:].sum for 1-indexed j = 1..n
+        suffix = np.concatenate([np.cumsum(xv[::-1])[::-1], [0]])
+        j = np.arange(1, n+1)
         # 1-indexed positions where the deletion could have happened.
-        for j in range(1, n+1):
-            if (ap + j*xp_deleted_symbol + xp[j-1:].sum) % (4*n+1) == R1p.asint() % (4*n+1):
-                Js.append(j)
-        if verbose: print(f"Possible locations: {Js}")
-
-        Jp = set()
+        Js = (np.flatnonzero((ap + j*sym + suffix) % M == R1p.asint() % M) + 1).tolist()
+
+        # Deleting any position of a run of the signature gives the same
+        # string, so the possible deletion locations in the signature for
+        # each j form an interval found from the runs of xp.signature.
+        runs = _runs(t)
+        patches = {}
+        windows = []
         for j in Js:
-            Jj = set()
-            xp_j = xp._insert(j, xp_deleted_symbol, idx_of_pos=1)
-            for jp in range(1,xp_j.signature.length +1):
-                if xp_j.signature._delete(jp, idx_of_pos=1) == xp.signature:
-                    Jj.add(jp)
-            Jp = Jp.union(Jj)
-
-        if verbose: print(f"Possible deletion locations: {Jp}")
-        u = min(Jp)
-        if verbose: print(f"P = {P}")
-        sig_deleted_symbol = (cp - R3p.asint()) % 2
-        sig = SVTCode().decode_deletion(xp.signature, R2p.asint(), u, P, sig_deleted_symbol, verbose=verbose)
+            patches[j] = _deletion_patch(xv, sym, j-1)
+            lo, hi = _deletion_window(t, runs, patches[j], j-1)
+            if lo <= hi:
+                windows.append((lo, hi))
+        u = min(lo for lo, _ in windows) if windows else None
+        _observe_candidates("deletion", Js, windows)
+        stats.event(verbose, "deletion", symbol=sym, Js=Js, u=u, P=P)
+        if u is None:
+            raise Exception("SingleEditCode could not decode the given string")
 
+        sig_deleted_symbol = (cp - R3p.asint()) % 2
+        with stats.stage("svt"):
+            sig = SVTCode().decode_deletion(QaryView(2, t), R2p.asint(), u, P, sig_deleted_symbol, verbose=verbose)
+
+        # The signature of the candidate for j agrees with t before the 
+        # patch and with t shifted by one after it
+        sig = sig.val
+        pre, suf = _common_prefix(sig, t), _common_suffix(sig, t)
+        m = t.shape[0] + 1
         for j in Js:
-            x_candidate = xp._insert(j, xp_deleted_symbol, idx_of_pos=1)
-            if x_candidate.signature == sig:
-                return x_candidate
+            p = j-1
+            if pre >= max(p-1, 0) and suf >= m-1-p and \
+            all(sig[i] == b for i, b in patches[j].items()):
+                return xp._insert(j, sym, idx_of_pos=1)
 
         raise Exception("SingleEditCode could not decode the given string")
 
 
     def _decode_insertion(self, x_enc, n, verbose):
-        if verbose:
-            print("Insertion detected.")
-            print("Computing parameters...")
         P = self._get_P(n)
         lengths = [n+1, 2, x_enc.bitlen(4*n+1), x_enc.bitlen(P), 1, 2]
         xp, Mp, R1p, R2p, R3p, R4p = x_enc.split(lengths)
         if xp[-1] == Mp[0]:
             return xp[:-1]
 
-        ap = xp.syndrome % (4*n + 1)
-        cp = xp.signature.parity_check
-        dp = xp.sum % 7
+        xv = xp.val.astype(np.int64)
+        s = np.empty(n, dtype=np.int8)
+        with stats.stage("checksums"):
+            ap, _, cp, dp = checksums(xv, sig=s)
+        ap %= 4*n + 1
+        dp %= 7
         xp_inserted_symbol = (dp - R4p.asint()) % 7
-        if verbose: print(f"Insertion of symbol {xp_inserted_symbol} detected.")
 
-        Js = []
+        M = 4*n + 1
+        sym = int(xp_inserted_symbol)
+        # suffix[j] = xp[j:].sum for j = 0..n+1
+        suffix = np.concatenate([np.cumsum(xv[::-1])[::-1], [0]])
+        j = np.arange(1, n+2)
         # 1-indexed positions where insertion could have occured
-        for j in range(1, n+2):
-            if xp.val[j-1] == xp_inserted_symbol and \
-            (ap - j*xp_inserted_symbol - xp[j:].sum) % (4*n+1) == R1p.asint() % (4*n+1):
-                Js.append(j)
-        if verbose: print(f"Possible locations: {Js}")
-
-        Jp = set()
+        Js = (np.flatnonzero((xv == sym) & 
+                             ((ap - j*sym - suffix[1:]) % M == R1p.asint() % M)) + 1).tolist()
+
+        # As for deletions, the possible insertion locations in the 
+        # signature for each j form an interval found from its runs
+        runs = _runs(s)
+        patches = {}
+        windows = []
         for j in Js:
-            Jj = set()
-            xp_j = xp._delete(j, idx_of_pos=1)
-            for jp in range(1,xp.signature.length +1):
-                if xp_j.signature == xp.signature._delete(jp, idx_of_pos=1):
-                    Jj.add(jp)
-            Jp = Jp.union(Jj)
-        if verbose: print(f"Possible insertion locations: {Jp}")
-        u = min(Jp)
-        if verbose: print(f"P = {P}")
+            patches[j] = _insertion_patch(xv, j-1)
+            lo, hi = _insertion_window(s, runs, patches[j], j-1)
+            if lo <= hi:
+                windows.append((lo, hi))
+        u = min(lo for lo, _ in windows) if windows else None
+        _observe_candidates("insertion", Js, windows)
+        stats.event(verbose, "insertion", symbol=sym, Js=Js, u=u, P=P)
+        if u is None:
+            raise Exception("SingleEditCode could not decode the given string")
 
         sig_inserted_symbol = (cp - R3p.asint()) % 2
-        sig = SVTCode().decode_insertion(xp.signature, R2p.asint(), u, P, sig_inserted_symbol, verbose=verbose)
-
+        with stats.stage("svt"):
+            sig = SVTCode().decode_insertion(QaryView(2, s), R2p.asint(), u, P, sig_inserted_symbol, verbose=verbose)
+
+        # The signature of the candidate for j agrees with s before the 
+        # patch and with s shifted by one after it
+        sig = sig.val
+        pre, suf = _common_prefix(sig, s), _common_suffix(sig, s)
+        m = s.shape[0]
         for j in Js:
-            x_candidate = xp._delete(j, idx_of_pos=1)
-            if x_candidate.signature == sig:
-                return x_candidate
+            p = j-1
+            if pre >= max(p-1, 0) and suf >= m-1-p and \
+            all(sig[i] == b for i, b in patches[j].items()):
+                return xp._delete(j, idx_of_pos=1)
 
         raise Exception("SingleEditCode could not decode the given string")
 
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming encoder/decoder between byte streams and codewords.
+
+Bytes are transcoded to quaternary four symbols per byte (most significant
+bits first), cut into fixed-size messages and encoded in batches. Only one
+chunk of input is held in memory at a time.
+"""
+
+from collections import namedtuple
+import numpy as np
+from .qary_string import QaryString
+from .util import pack_2bit, unpack_2bit
+
+Frame = namedtuple("Frame", ["index", "codeword", "n", "N", "l"])
+Frame.__doc__ = """
+A codeword produced by encode_stream, with the parameters needed to decode it.
+index:      position of the message in the stream
+codeword:   QaryString of length N (or N +- 1 after an edit)
+n, N, l:    as returned by SingleEditCode.encode
+"""
+
+def bytes_to_quaternary(data):
+    """
+    Return: numpy int8 array of 4*len(data) symbols
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    return unpack_2bit(data, 4 * data.shape[0])
+
+def quaternary_to_bytes(x):
+    """
+    Inverse of bytes_to_quaternary. x: numpy array, length a multiple of 4
+    """
+    if x.shape[0] % 4 != 0:
+        raise Exception("Number of symbols must be a multiple of 4")
+    return pack_2bit(x).tobytes()
+
+def _read_chunks(stream, chunk_size):
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def encode_stream(stream, code, message_length=160, chunk_size=1 << 16):
+    """
+    Encode a binary stream into codewords.
+
+    stream:         file-like object opened in binary mode
+    code:           SingleEditCode
+    message_length: number of quaternary symbols per message, a multiple of 4.
+                    The last message may be shorter.
+    chunk_size:     number of bytes read from the stream at a time
+    Yield: Frame for each message, in order
+    """
+    if message_length <= 0 or message_length % 4 != 0:
+        raise Exception("message_length must be a positive multiple of 4")
+    message_bytes = message_length // 4
+    chunk_size = max(chunk_size - chunk_size % message_bytes, message_bytes)
+    index = 0
+    pending = b""
+    for chunk in _read_chunks(stream, chunk_size):
+        pending += chunk
+        usable = len(pending) - len(pending) % message_bytes
+        if usable == 0:
+            continue
+        messages = bytes_to_quaternary(pending[:usable]).reshape(-1, message_length)
+        pending = pending[usable:]
+        for frame in _encode_messages(code, messages, index):
+            yield frame
+        index += messages.shape[0]
+    if pending:
+        for frame in _encode_messages(code, [bytes_to_quaternary(pending)], index):
+            yield frame
+
+def _encode_messages(code, messages, index):
+    X_enc, n, N, l = code.encode_batch(messages)
+    for i in range(len(n)):
+        yield Frame(index + i, QaryString(4, X_enc[i, :N[i]]), n[i], N[i], l[i])
+
+def decode_stream(frames, code, batch_size=1024):
+    """
+    Decode codewords back into the bytes of the original stream.
+
+    frames:     iterable of Frame, in stream order. Raises if the indices
+                do not run 0, 1, 2, ..., e.g. after a frame was lost, 
+                since the output would silently be missing data. A lost
+                last frame cannot be detected this way. 
+    code:       SingleEditCode
+    batch_size: number of frames decoded together
+    Yield: bytes of each decoded message, in order
+    """
+    batch = []
+    for expected, frame in enumerate(frames):
+        if frame.index != expected:
+            raise Exception(f"Expected frame {expected}, got frame {frame.index}")
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield from _decode_frames(code, batch)
+            batch = []
+    if batch:
+        yield from _decode_frames(code, batch)
+
+def _decode_frames(code, frames):
+    X_dec, l = code.decode_batch([f.codeword.val for f in frames],
+                                 [f.n for f in frames], [f.N for f in frames],
+                                 [f.l for f in frames])
+    for i in range(len(frames)):
+        yield quaternary_to_bytes(X_dec[i, :l[i]])
+
+def encode_file(path, code, message_length=160, chunk_size=1 << 16):
+    """
+    encode_stream over the file at path. Yield: Frame
+    """
+    with open(path, "rb") as f:
+        yield from encode_stream(f, code, message_length, chunk_size)
+
+def decode_to_file(frames, code, path, batch_size=1024):
+    """
+    decode_stream into the file at path. Return: number of bytes written
+    """
+    written = 0
+    with open(path, "wb") as f:
+        for data in decode_stream(frames, code, batch_size):
+            f.write(data)
+            written += len(data)
+    return written
@@ -7,12 +7,20 @@ Created on Wed Feb 19 01:31:03 2020
 
 
 import numpy as np
-from .qary_string import QaryString
-from .util import is_k_sum_balanced
-from scipy.special import comb
+from .qary_string import QaryString, QaryView
+from .util import is_k_sum_balanced, forbidden_windows, int_from_digits, int_to_digits, keystream
+from . import table_cache
+from . import stats
+from bisect import bisect_right
+from itertools import accumulate
+from functools import lru_cache
+from math import comb
 
 def binom(N, r):
-    return comb(N, r, exact=True)
+    # Exact binomial coefficient, 0 unless 0 <= r <= N
+    if r < 0 or r > N:
+        return 0
+    return comb(N, r)
 
 class CombinatorialBitstringEncoder:
     def __init__(self):
@@ -69,11 +77,234 @@ class CombinatorialBitstringEncoder:
         # The number of k-length bitstrings with sum w
         return binom(k, w)
 
+class BinomialTable:
+    """
+    Pascal's triangle up to row k, stored column by column. Ranking a 
+    k-length bitstring is a sum of table lookups, and unranking is a binary 
+    search over one (non-decreasing) column per set bit. Gives the same 
+    results as CombinatorialBitstringEncoder without evaluating binomials. 
+    
+    Tables are shared: use BinomialTable.for_k(k) rather than the constructor.
+    """
+    _tables = {}
+    
+    def __init__(self, k):
+        self.k = k
+        # cols[t][n] = binom(n, t) for 0 <= n <= k
+        self.cols = [[1] * (k+1)]
+        for t in range(1, k+1):
+            prev = self.cols[-1]
+            col = [0] * (k+1)
+            for n in range(1, k+1):
+                col[n] = col[n-1] + prev[n-1]
+            self.cols.append(col)
+            
+    @classmethod
+    def for_k(cls, k):
+        if k not in cls._tables:
+            cls._tables[k] = cls(k)
+        return cls._tables[k]
+    
+    def binom(self, n, r):
+        if r < 0 or r > n: return 0
+        return self.cols[r][n]
+    
+    def rank(self, s):
+        """
+        s: A k-length bitstring. numpy array.
+        Return: (k, w, index) as in CombinatorialBitstringEncoder.encode
+        """
+        indices = np.flatnonzero(s).tolist()
+        cols = self.cols
+        index = 0
+        for t, ct in enumerate(indices):
+            index += cols[t+1][ct]
+        return len(s), len(indices), index
+    
+    def unrank(self, w, index):
+        """
+        Inverse of rank. Return: k-length bitstring with w ones. numpy array.
+        """
+        k = self.k
+        s = np.zeros(k, dtype=int)
+        for t in range(w, 0, -1):
+            col = self.cols[t]
+            # Largest ct < k with binom(ct, t) <= index
+            ct = min(bisect_right(col, index), k) - 1
+            s[ct] = 1
+            index -= col[ct]
+        return s
+
+class _SpliceBuffer:
+    """
+    Gap buffer holding the string being sum-balanced. The logical string is
+    val[:left] followed by val[right:end]. Cutting a window off the end of the
+    left part only moves `left`, and replacement blocks are written into the 
+    spare capacity after `end`, so neither needs to copy the whole string. 
+    """
+    def __init__(self, val):
+        self.val = np.zeros(max(2 * len(val), 16), dtype=np.int8)
+        self.val[:len(val)] = val
+        self.left = 0
+        self.right = 0
+        self.end = len(val)
+        
+    def advance(self, m):
+        # Move up to m symbols from the right part to the left part.
+        # Return the number of symbols moved. 
+        m = min(m, self.end - self.right)
+        if self.right != self.left:
+            self.val[self.left:self.left + m] = self.val[self.right:self.right + m]
+        self.left += m
+        self.right += m
+        return m
+    
+    def window_sum(self, k):
+        return int(np.sum(self.val[self.left - k:self.left], dtype=np.int64))
+    
+    def lookahead(self, k, m):
+        # The current window followed by up to m symbols of the right part
+        return np.concatenate([self.val[self.left - k:self.left], 
+                               self.val[self.right:min(self.right + m, self.end)]])
+    
+    def append(self, block):
+        if self.end + len(block) > len(self.val):
+            # Out of capacity; close the gap while growing
+            size = self.left + self.end - self.right + len(block)
+            val = np.zeros(2 * size, dtype=np.int8)
+            val[:self.left] = self.val[:self.left]
+            val[self.left:size - len(block)] = self.val[self.right:self.end]
+            self.val = val
+            self.right = self.left
+            self.end = size - len(block)
+        self.val[self.end:self.end + len(block)] = block
+        self.end += len(block)
+        
+    def toqstr(self, q):
+        return QaryString._wrap(q, np.concatenate([self.val[:self.left], 
+                                                   self.val[self.right:self.end]]))
+
+class _UnspliceBuffer:
+    """
+    Gap buffer for undoing the replacements of SumBalancedCode.encode, last
+    first: each step removes the block at the end of the string and inserts
+    the word it encodes at its position. The logical string is val[:left]
+    followed by rval[right:end]. Consecutive positions are close together, 
+    so moving the gap to each costs O(k) rather than copying the string. 
+    size: upper bound on the length of the string
+    """
+    def __init__(self, val, size):
+        self.val = np.zeros(size, dtype=np.int8)
+        self.val[:len(val)] = val
+        self.left = len(val)
+        self.rval = np.zeros(2 * size, dtype=np.int8)
+        self.right = self.end = 2 * size
+        
+    @property
+    def length(self):
+        return self.left + self.end - self.right
+    
+    def last(self):
+        return self.rval[self.end - 1] if self.end > self.right else self.val[self.left - 1]
+        
+    def move_to(self, i):
+        # Move the gap to position i of the logical string
+        if i < self.left:
+            m = self.left - i
+            if self.right < m:
+                # Out of room before the right part; shift it to the end
+                r = self.end - self.right
+                self.rval[len(self.rval) - r:] = self.rval[self.right:self.end]
+                self.right, self.end = len(self.rval) - r, len(self.rval)
+            self.rval[self.right - m:self.right] = self.val[i:self.left]
+            self.right -= m
+        else:
+            m = i - self.left
+            self.val[self.left:i] = self.rval[self.right:self.right + m]
+            self.right += m
+        self.left = i
+        
+    def pop(self, m):
+        # Remove and return the last m symbols
+        if self.end - self.right < m:
+            self.move_to(self.length - m)
+        self.end -= m
+        return self.rval[self.end:self.end + m]
+    
+    def insert(self, i, word):
+        self.move_to(i)
+        self.val[i:i + len(word)] = word
+        self.left += len(word)
+        
+    def toarray(self):
+        return np.concatenate([self.val[:self.left], self.rval[self.right:self.end]])
+
+# Attributes of SumBalancedCode that __getstate__ leaves out
+_UNPICKLED = ("_rank_cache", "_unrank_cache", "_ranker", "_table_mmap", "bucket2sumpair",
+              "sumpair2bucket", "bucket2startidx", "bucket2size")
+
 class SumBalancedCode:
-    def __init__(self, k, q=4):
+    def __init__(self, k, q=4, cache_dir=None, tables=None, fixed_length=False,
+                 cache_size=1024, whiten=False):
+        """
+        cache_dir: Optional directory in which the precomputed bucket tables
+            are saved, and from which they are memory-mapped when available. 
+        tables: Optional buffer holding the bucket tables serialized by 
+            table_cache.dump_buckets, e.g. shared memory. Used without copying. 
+        fixed_length: Pad every replacement block to k symbols, so that the 
+            encoded string always has length len(s)+1. 
+        cache_size: Number of forbidden words remembered by each of the LRU
+            caches in front of ranking and unranking, see cache_info. 0 
+            disables caching, None makes the caches unbounded. 
+        whiten: Add a fixed pseudorandom keystream to the string (mod q) 
+            before sum-balancing, and subtract it after decoding. Low-entropy
+            input, e.g. long runs of one symbol, then rarely contains 
+            forbidden words. 
+        """
         self.k = k
         self.q = q
-        self._compute_buckets()
+        self.fixed_length = fixed_length
+        self.whiten = whiten
+        self._ranker = None
+        self._cache_size = cache_size
+        self._make_caches()
+        if tables is not None:
+            table_cache.load_buckets(self, tables)
+        elif cache_dir is None:
+            self._compute_buckets()
+        else:
+            table_cache.load_or_build(self, cache_dir)
+        if fixed_length:
+            # Raises if no string at all fits
+            self._block_lengths(1)
+            
+    def _make_caches(self):
+        # Keyed by the bytes of the int8 word, and by index
+        self._rank_cache = lru_cache(maxsize=self._cache_size)(self._rank_bytes)
+        self._unrank_cache = lru_cache(maxsize=self._cache_size)(self._unrank)
+        
+    def __getstate__(self):
+        # The caches are bound to this object, and loaded tables may be views
+        # of a memory map or shared memory, so the tables are sent serialized
+        state = {key: value for key, value in self.__dict__.items() 
+                 if key not in _UNPICKLED}
+        state["_tables"] = table_cache.dump_buckets(self)
+        return state
+    
+    def __setstate__(self, state):
+        state = dict(state)
+        tables = state.pop("_tables")
+        self.__dict__.update(state)
+        self._ranker = None
+        self._make_caches()
+        table_cache.load_buckets(self, tables)
+            
+    @property
+    def ranker(self):
+        # Built on first use, so that loading cached tables stays cheap
+        if self._ranker is None:
+            self._ranker = BinomialTable.for_k(self.k)
+        return self._ranker
         
     def _compute_buckets(self, verbose=False):
         """
@@ -82,70 +313,130 @@ class SumBalancedCode:
         
         Note: This code has not been designed to work for q=/=4
         """
-        self.sumpair2bucket = {}
-        self.bucket2sumpair = []
-        self.bucket2size = []
-
-        idx = 0
         k = self.k
-        for a in range(k+1):
-            sz_a = CombinatorialBitstringEncoder.num_bitstring(k,a)
-            for b in range(k+1):
-                sz_b = CombinatorialBitstringEncoder.num_bitstring(k,b)
-                if 2*a + b <= k or 2*a + b >= 2*k:
-                    if verbose: print(a, b, idx)
-                    self.sumpair2bucket[(a,b)] = idx
-                    self.bucket2sumpair.append((a,b))
-                    self.bucket2size.append(sz_a * sz_b)
-                    idx += 1
-                    
-        self.bucket2startidx = [0]*len(self.bucket2size)  
-        start_idx = 0
-        for bucket_idx, bucket_size in enumerate(self.bucket2size):
-            self.bucket2startidx[bucket_idx] = start_idx
-            start_idx += bucket_size
+        a, b = np.meshgrid(np.arange(k+1), np.arange(k+1), indexing="ij")
+        forbidden = (2*a + b <= k) | (2*a + b >= 2*k)
+        
+        # Buckets are numbered in row-major order of (a,b). 
+        # sumpair2bucket[a,b] is -1 for pairs that are sum-balanced. 
+        self.bucket2sumpair = np.argwhere(forbidden)
+        self.sumpair2bucket = np.full((k+1, k+1), -1, dtype=np.int64)
+        self.sumpair2bucket[forbidden] = np.arange(len(self.bucket2sumpair))
+        if verbose:
+            for idx, (a, b) in enumerate(self.bucket2sumpair): print(a, b, idx)
+
+        # Bucket sizes and offsets overflow 64 bits for moderate k, so they
+        # are kept as sorted lists of python ints and searched with bisect.
+        sz = [self.ranker.binom(k, i) for i in range(k+1)]
+        self.bucket2size = [sz[a] * sz[b] for a, b in self.bucket2sumpair.tolist()]
+        self.bucket2startidx = [0] + list(accumulate(self.bucket2size[:-1]))
         return self
     
+    def cache_info(self):
+        """
+        Return: dict of functools cache statistics (hits, misses, maxsize, 
+                currsize) for "rank", word to index, and "unrank", index to 
+                word
+        """
+        return {"rank": self._rank_cache.cache_info(), 
+                "unrank": self._unrank_cache.cache_info()}
+    
+    def cache_clear(self):
+        self._rank_cache.cache_clear()
+        self._unrank_cache.cache_clear()
+        
     @property
     def _num_fwords(self):
         return self.bucket2startidx[-1] + self.bucket2size[-1]
     
     def _fword_to_index(self, word):
         # word: A non-k-sum-balanced word of length k. 
+        return self._rank_cache(np.asarray(word.val, dtype=np.int8).tobytes())
+    
+    def _index_to_fword(self, index):
+        # index: An integer representing a non-k-sum-balanced word of length k.  
+        # The cached array is shared, so return a copy
+        return QaryString(self.q, self._unrank_cache(index))
+    
+    def _rank_bytes(self, data):
         # qary string (k,) -> binary matrix (k, log2q) -> bucket (log2q,) -> bucket index: int
-
+        word = QaryView(self.q, np.frombuffer(data, dtype=np.int8))
         q, bm = word.as_binary_matrix
         a_str, b_str = bm[:,0], bm[:,1]
-        k, a, a_index = CombinatorialBitstringEncoder.encode(a_str)
-        _, b, b_index = CombinatorialBitstringEncoder.encode(b_str)
-        num_b = CombinatorialBitstringEncoder.num_bitstring(k, b)
+        k, a, a_index = self.ranker.rank(a_str)
+        _, b, b_index = self.ranker.rank(b_str)
+        num_b = self.ranker.binom(k, b)
         index_in_bucket = a_index * num_b + b_index
 
-        bucket = self.sumpair2bucket[(a,b)]
+        bucket = self.sumpair2bucket[a, b]
+        if bucket < 0:
+            raise Exception("Word is sum-balanced and has no index")
         return self.bucket2startidx[bucket] + index_in_bucket
     
-    def _index_to_fword(self, index):
-        # index: An integer representing a non-k-sum-balanced word of length k.  
-        
-        # First locate the bucket
-        bucket = 0
-        while self.bucket2startidx[bucket] <= index:
-            bucket += 1
-            if bucket >= len(self.bucket2startidx):
-                break
-        bucket -= 1 # Maximum bucket not exceeding. 
-        a,b = self.bucket2sumpair[bucket]
+    def _unrank(self, index):
+        # First locate the bucket: maximum bucket start not exceeding index
+        bucket = bisect_right(self.bucket2startidx, index) - 1
+        a, b = self.bucket2sumpair[bucket].tolist()
         index_in_bucket = index - self.bucket2startidx[bucket]
         
-        num_b = CombinatorialBitstringEncoder.num_bitstring(self.k, b)
+        num_b = self.ranker.binom(self.k, b)
         a_index = index_in_bucket // num_b
         b_index = index_in_bucket % num_b
-        a_str = CombinatorialBitstringEncoder.decode(self.k, a, a_index)
-        b_str = CombinatorialBitstringEncoder.decode(self.k, b, b_index)
+        a_str = self.ranker.unrank(a, a_index)
+        b_str = self.ranker.unrank(b, b_index)
         bm = np.stack([a_str, b_str], axis=1)
-        word = QaryString.from_binary_matrix(q=self.q, m=bm)
+        word = QaryString.from_binary_matrix(q=self.q, m=bm).val
+        word.flags.writeable = False
         return word
         
+    def _block_lengths(self, s_len):
+        """
+        Lengths of the fields of a replacement block for strings of length
+        s_len: word index, position, [filler,] end-of-block marker. Filler is
+        only present in fixed-length mode. 
+        """
+        lengths = [QaryString(self.q).bitlen(self._num_fwords), 
+                   QaryString(self.q).bitlen(s_len), 1]
+        if self.fixed_length:
+            pad = self.k - sum(lengths)
+            if pad < 0:
+                # The position field has k - idx_len - 1 digits to spare
+                spare = self.k - lengths[0] - 1
+                limit = f"at most {self.q ** spare}" if spare > 0 else "no"
+                raise Exception(f"Fixed-length mode with k = {self.k} supports strings of "
+                                f"{limit} symbols, not {s_len}; use k >= {sum(lengths)}")
+            lengths.insert(2, pad)
+        return lengths
+    
+    def length_bounds(self, l):
+        """
+        Bounds on the length n of encode(s) over all s of length l, without 
+        encoding. Each replacement of a forbidden word shortens the string by
+        d = k - (block length), so n = l+1 - r*d for r replacements. 
+        
+        n_max is the largest n, reached by any s without forbidden windows. 
+        n_lower only uses that a replacement needs at least k symbols, and is
+        a loose lower bound: replaced blocks can themselves be replaced, but 
+        far fewer times than it allows (for k = 128 and l = 1000, n_lower = 
+        125 while the all-zeros message gives n = 909). Both are l+1 when 
+        d = 0 (fixed-length mode) or l + 1 < k. 
+        
+        Raises if d < 0, i.e. blocks are longer than k (k <= 64 for most l), 
+        as every replacement then lengthens the string and no bound on n is
+        known. 
+        Return: (n_lower, n_max)
+        """
+        block = sum(self._block_lengths(l))
+        d = self.k - block
+        if l + 1 < self.k or d == 0:
+            return l + 1, l + 1
+        if d < 0:
+            raise Exception(f"Replacement blocks for strings of length {l} are {block} symbols, "
+                            f"longer than k = {self.k}, so the encoded length is not bounded; "
+                            f"use k >= {block}")
+        r_max = (l + 1 - self.k) // d + 1
+        return l + 1 - r_max * d, l + 1
+    
     def encode(self, s):
         """
         Parameter:
@@ -153,29 +444,81 @@ class SumBalancedCode:
         Return
             x: a k-sum-balanced QaryString
         """
+        k = self.k
+        q = s.q
+        lengths = self._block_lengths(s.length)
+        idx_len, pos_len = lengths[0], lengths[1]
+        filler = np.resize(np.array([1, 2], dtype=np.int8), lengths[2] if self.fixed_length else 0)
+        # Replacement block with the index and position fields left blank
+        template = np.concatenate([np.zeros(idx_len + pos_len, dtype=np.int8), 
+                                   filler, [3]]).astype(np.int8)
+        # A window is sum-balanced iff lo < sum(window) < hi
+        lo, hi = (q // 2 - 1) * k, (q // 2) * k
+        
+        rec = stats.active()
+        replacements = 0
+        
         # Step 1: Append 0
-        x = s.concatenate(QaryString(s.q, [0]))
+        val = s.val
+        if self.whiten:
+            val = (val + keystream(s.length, q)) % q
+        buf = _SpliceBuffer(np.concatenate([val, [0]]))
         
         # Step 2: Sequence replacement of all forbidden words
-        i = 0 # Index into x
-        k = self.k
+        # The current window is always buf.val[buf.left-k : buf.left]
+        if buf.advance(k) < k:
+            if rec is not None: rec.observe("sum_balance.replacements", 0)
+            return buf.toqstr(q), s.length
+        wsum = buf.window_sum(k)
+        # Number of symbols scanned ahead at a time while windows are balanced
+        chunk = k
         
-        while i <= x.length - k:
-            word = x[i:i+k]
-            if not word.is_sum_balanced:
-                index = self._fword_to_index(word)                
-                x = x[:i].concatenate([
-                    x[i+k:], 
-                    QaryString(x.q).fromint(index).pad_to(x.bitlen(self._num_fwords)),
-                    QaryString(x.q).fromint(i).pad_to(x.bitlen(s.length)),
-                    QaryString(x.q, val=[3])
-                ])
+        while True:
+            if not lo < wsum < hi:
+                i = buf.left - k
+                index = self._rank_cache(buf.val[i:buf.left].tobytes())
+                buf.left = i
+                block = template.copy()
+                digits = int_to_digits(index, q)
+                block[idx_len - len(digits):idx_len] = digits
+                digits = int_to_digits(i, q)
+                if len(digits) > pos_len:
+                    # Only possible when blocks are longer than k, so that
+                    # each replacement lengthens the string
+                    raise Exception("String grew past the range of the position field; use a larger k")
+                block[idx_len + pos_len - len(digits):idx_len + pos_len] = digits
+                buf.append(block)
+                # Only windows overlapping the splice need to be rescanned
                 rewind = min(i, k)
-                i = i - rewind
-            else: 
-                i += 1
+                replacements += 1
+                if self.fixed_length and replacements > s.length + 1:
+                    # Blocks of exactly k symbols do not shorten the string,
+                    # so nothing else guarantees termination. At most l+1 
+                    # replacements can remove a symbol of s; beyond that,
+                    # blocks are being replaced over and over
+                    raise Exception("Fixed-length encoding did not terminate; use a larger k")
+                if rec is not None: rec.observe("sum_balance.rewind", rewind)
+                if buf.advance(k - rewind) < k - rewind:
+                    break
+                wsum = buf.window_sum(k)
+                chunk = k
+            else:
+                if buf.right == buf.end:
+                    break
+                # Jump to the next window that is not sum-balanced, or past
+                # the scanned symbols if there is none
+                seg = buf.lookahead(k, chunk)
+                bad = forbidden_windows(seg[1:], k, q)
+                if bad.shape[0]:
+                    buf.advance(int(bad[0]) + 1)
+                    wsum = buf.window_sum(k)
+                else:
+                    buf.advance(seg.shape[0] - k)
+                    wsum = int(seg[-k:].sum())
+                    chunk = min(2 * chunk, 1 << 14)
                 
-        return x, s.length
+        if rec is not None: rec.observe("sum_balance.replacements", replacements)
+        return buf.toqstr(q), s.length
     
     def decode(self, x, s_len):
         """
@@ -184,17 +527,20 @@ class SumBalancedCode:
         Return
             x: The decoded string
         """
-        sentinel = QaryString(x.q, [0])    
-        lengths = [x.bitlen(self._num_fwords), x.bitlen(s_len), 1]
-        block_len = np.sum(lengths)
-        while x[-1] != sentinel:
-            index_str, i_str, _ = x[-block_len:].split(lengths)
-            i = i_str.asint()
-            index = index_str.asint()
-            word = self._index_to_fword(index)
-            x = x[:i].concatenate([
-                word, 
-                x[i:-block_len]
-            ])
-        x = x[:-1]
-        return x    
\ No newline at end of file
+        lengths = self._block_lengths(s_len)
+        idx_len, pos_len = lengths[0], lengths[1]
+        block_len = sum(lengths)
+        # Each step changes the length by the same amount, so the string is
+        # longest either now or once decoded
+        buf = _UnspliceBuffer(x.val, max(x.length, s_len + 1))
+        while buf.last() != 0:
+            block = buf.pop(block_len)
+            index = int_from_digits(block[:idx_len], x.q)
+            i = int_from_digits(block[idx_len:idx_len + pos_len], x.q)
+            if i > buf.length:
+                raise Exception("Invalid replacement block in decode()")
+            buf.insert(i, self._unrank_cache(index))
+        val = buf.toarray()[:-1]
+        if self.whiten:
+            val = (val - keystream(val.shape[0], x.q)) % x.q
+        return QaryString._wrap(x.q, val)    
\ No newline at end of file
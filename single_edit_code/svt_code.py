@@ -6,51 +6,136 @@ Created on Tue Feb 11 22:19:12 2020
 """
 
 
+import numpy as np
 from .qary_string import QaryString
+from . import stats
 
 def first_index_k_zeros_left(qstr, k, P):
     """
     For a binary string qstr, return the first index of q with k (mod P) zeros to the left.
     Return: index in [0, qstr.length]
     """
-    num_zeros_left = 0
-    for j in range(qstr.length+1):
-        if (num_zeros_left - k) % P == 0:
-            return j
-        if j == qstr.length: 
-            raise Exception("No valid position found")
-        if qstr[j] == 0:
-            num_zeros_left += 1
+    zeros_left = np.concatenate([[0], np.cumsum(qstr.val == 0)])
+    match = (zeros_left - k) % P == 0
+    if not match.any():
+        raise Exception("No valid position found")
+    return int(np.argmax(match))
             
 def first_index_k_ones_right(qstr, k, P):
     """
     For a binary string qstr, return the first index of q with k (mod P) ones to the right.
     Return: index in [0, qstr.length]
     """
-    num_ones_right = 0
-    for j in range(qstr.length, -1, -1):
-        if (num_ones_right - k) % P == 0:
-            return j
-        if j == 0: 
-            raise Exception("No valid position found")
-        if qstr[j-1] == 1:
-            num_ones_right += 1
+    ones = np.concatenate([[0], np.cumsum(qstr.val == 1)])
+    match = (ones[-1] - ones - k) % P == 0
+    if not match.any():
+        raise Exception("No valid position found")
+    return qstr.length - int(np.argmax(match[::-1]))
+
+def _first_matches(counts, k, P, lo, hi, last=False):
+    """
+    Row-wise first (or last) column c in [lo, hi] with counts[c] = k (mod P)
+    counts: (B, L+1) array. k, P, lo, hi: (B,) arrays. 
+    """
+    cols = np.arange(counts.shape[1])
+    match = ((counts - k[:, None]) % P[:, None] == 0) & \
+            (cols >= lo[:, None]) & (cols <= hi[:, None])
+    if not match.any(axis=1).all():
+        raise Exception("No valid position found")
+    if last:
+        return counts.shape[1] - 1 - np.argmax(match[:, ::-1], axis=1)
+    return np.argmax(match, axis=1)
 
 class SVTCode:
     """
     Implemented based on Algorithm 2 in 
     https://arxiv.org/pdf/1602.06820.pdf
+    
+    The redundancy of a binary string x is the pair (a, c) of its VT 
+    syndrome modulo P and its parity. Given (a, c), the length of x and a
+    position u such that the edit lies in [u, u+P), decode() corrects a 
+    single insertion or deletion. 
     """
         
-    def __init__(self):
-        pass
+    def __init__(self, P=None):
+        """
+        P: default window size for encode/decode
+        """
+        self.P = P
+        
+    def _get_P(self, P):
+        P = self.P if P is None else P
+        if P is None:
+            raise Exception("SVTCode requires P")
+        return P
     
-    def encode(self, x):
+    def encode(self, x, P=None):
         """
         x: QaryString with q=2, length=n
+        P: window size, defaults to the one given to the constructor
+        Return: (a, c), the VT syndrome of x modulo P and the parity of x
+        """
+        P = self._get_P(P)
+        return x.syndrome % P, x.parity_check
+    
+    def encode_batch(self, X, P=None, lengths=None):
         """
-        x_enc = None
-        return x_enc
+        encode for every row of the 2-D binary array X, whose rows have 
+        lengths `lengths` (zero-padded) or are all X.shape[1] long
+        Return: (a, c) as int arrays
+        """
+        P = self._get_P(P)
+        X = np.asarray(X)
+        if lengths is not None:
+            X = np.where(np.arange(X.shape[1]) < np.asarray(lengths)[:, None], X, 0)
+        X = X.astype(np.int64)
+        a = (X @ np.arange(1, X.shape[1] + 1)) % P
+        c = X.sum(axis=1) % 2
+        return a, c
+    
+    def decode(self, y, n, a, c, u, P=None, verbose=False):
+        """
+        y: A QaryString, q=2, with at most one symbol inserted or deleted
+        n: length of the original string
+        a, c: redundancy returned by encode
+        u: first possible position of the edit, 1-indexed
+        """
+        P = self._get_P(P)
+        if y.length == n:
+            return y
+        # The parity tells which symbol was inserted or deleted
+        val = (y.parity_check - c) % 2
+        if y.length == n-1:
+            return self.decode_deletion(y, a, u, P, val, verbose=verbose)
+        if y.length == n+1:
+            return self.decode_insertion(y, a, u, P, val, verbose=verbose)
+        raise Exception("y has invalid length in decode()")
+    
+    def decode_batch(self, Y, n, a, c, u, P=None, lengths=None):
+        """
+        decode for every row of the 2-D binary array Y. 
+        n, a, c, u: per-row arrays (or scalars) of the decode arguments
+        lengths: optional lengths of the rows of Y, which are otherwise all
+                 Y.shape[1]
+        Return: (X, n) with X a 2-D array holding the decoded strings, 
+                zero-padded
+        """
+        P = self._get_P(P)
+        Y, lengths, n, a, c, u, P = self._batch_args(Y, lengths, n, a, c, u, P)
+        if np.any(np.abs(lengths - n) > 1):
+            raise Exception("Y has rows of invalid length in decode_batch()")
+        # The parity tells which symbol was inserted or deleted
+        _, parity = self.encode_batch(Y, 2, lengths)
+        val = (parity - c) % 2
+        X = np.zeros((Y.shape[0], Y.shape[1] + 1), dtype=Y.dtype)
+        same = np.flatnonzero(lengths == n)
+        X[same, :Y.shape[1]] = Y[same]
+        for decode_batch, r in [(self.decode_deletion_batch, np.flatnonzero(lengths == n-1)),
+                                (self.decode_insertion_batch, np.flatnonzero(lengths == n+1))]:
+            if r.shape[0] > 0:
+                Xr, _ = decode_batch(Y[r], a[r], u[r], P[r], val[r], lengths=lengths[r])
+                X[r, :Xr.shape[1]] = Xr
+        return X[:, :n.max(initial=0)], n
     
     def decode_deletion(self, y, a, u, P, delval, verbose=False):
         """
@@ -60,46 +145,32 @@ class SVTCode:
         P: upper bound on number of positions where deletion could have occurred. 
         delval: deleted symbol. One of 0,1
         """
-        q = min(P, y.length - u + 2)
-        lengths = [u-1, q-1, y.length-u-q+2]
-        if verbose: print(f"Splitting string into lengths of: {lengths}")
-        yhead, yhat, ytail = y.split(lengths)
-        if verbose: print(f"yhead = {yhead} \nyhat = {yhat} \nytail = {ytail}")        
-        if verbose: print(f"Running SVT decode with u = {u}, P={P}, delval={delval}, a={a}")
+        n = y.length
+        q = min(P, n - u + 2)
+        # yhat = y[u-1 : u+q-2] is the window containing the deletion
+        lo, hi = u-1, u+q-2
+        stats.event(verbose, "svt.deletion", lo=lo, hi=hi, u=u, P=P, delval=delval, a=a)
         
-        ap = (y.syndrome + ytail.sum) % P
-        if verbose: print(f"Augmented weighted sum of {ap}")
+        yv = y.val
+        ones = np.concatenate([[0], np.cumsum(yv == 1)])
+        ap = (y.syndrome + ones[n] - ones[hi]) % P
         delta = (a - ap) % P
         
-        if verbose: print(f"delta = {delta}")
-        
         if delval == 0:
-            delpos = first_index_k_ones_right(yhat, delta, P)
-            # Zero indexed
             # First position to the left of delta ones, not necessarily consecutive
-            """
-            num_ones_right = 0
-            for k in range(yhat.length, -1, -1):
-                if num_ones_right == delta:
-                    delpos = k
-                    break
-                if yhat[k-1] == 1:
-                    num_ones_right += 1
-            if delpos is None: raise Exception("delval = 0 should not reach here")
-            """
+            delpos = first_index_k_ones_right(y[lo:hi], delta, P)
         if delval == 1:
-            num_zeros_left = (delta - u - yhat.sum) % P
-            if verbose: print(f"finding first position to the right of " 
-                              f"{delta} - {u} - {yhat.sum} (mod {P}) = "                           
-                              f"{num_zeros_left} zeros")
-            delpos = first_index_k_zeros_left(yhat, delta - u - yhat.sum, P)
-            # Zero indexed
             # First position to the right of delta - mu - wt(yhat) zeros
+            yhat_sum = ones[hi] - ones[lo]
+            delpos = first_index_k_zeros_left(y[lo:hi], delta - u - yhat_sum, P)
             
-        if verbose: print(f"delpos = {delpos}")
-        yhat = yhat._insert(delpos, delval, idx_of_pos = 0)
-        if verbose: print(f"New yhat: {yhat}")
-        return yhead.concatenate(yhat).concatenate(ytail)
+        stats.event(verbose, "svt.deletion_position", ap=ap, delta=delta, delpos=delpos)
+        pos = lo + delpos
+        x = np.empty(n + 1, dtype=yv.dtype)
+        x[:pos] = yv[:pos]
+        x[pos] = delval
+        x[pos+1:] = yv[pos:]
+        return y._like(x)
     
     def decode_insertion(self, y, a, u, P, insval, verbose=False):
         """
@@ -109,31 +180,138 @@ class SVTCode:
         P: upper bound on number of positions where insertion could have occurred. 
         insval: inserted symbol. One of 0,1
         """
-        q = min(P, y.length - u + 1)
-        lengths = [u-1, q, y.length-u-q+1]
-        if verbose: print(f"Splitting y according to lengths {lengths}")
-        yhead, yhat, ytail = y.split(lengths)
-        if verbose: print(f"yhead = {yhead} \nyhat = {yhat} \nytail = {ytail}")        
-        if verbose: print(f"Running SVT decode with u = {u}, P={P}, insval={insval}, a={a}")
+        n = y.length
+        q = min(P, n - u + 1)
+        # yhat = y[u-1 : u+q-1] is the window containing the insertion
+        lo, hi = u-1, u+q-1
+        stats.event(verbose, "svt.insertion", lo=lo, hi=hi, u=u, P=P, insval=insval, a=a)
         
-        ap = (y.syndrome - ytail.sum) % P
-        if verbose: print(f"Augmented weighted sum of {ap}")
+        yv = y.val
+        ones = np.concatenate([[0], np.cumsum(yv == 1)])
+        ap = (y.syndrome - (ones[n] - ones[hi])) % P
         delta = (ap - a) % P
         
-        if verbose: print(f"delta = {delta}")
-        
         if insval == 0:
             # A zero was inserted to the left of delta ones. 
-            if verbose: print(f"Finding first position to the left of {delta} ones")
-            inspos = first_index_k_ones_right(yhat, delta, P)
+            inspos = first_index_k_ones_right(y[lo:hi], delta, P)
             # Minus one because the above function was written for the deletion case. 
             inspos = inspos - 1
         if insval == 1:
             # A one was inserted to the right of (delta - u - wy(yhat)) zeros. 
-            if verbose: print(f"Finding first position to the right of {delta} - "
-                  f"{u} - {yhat.sum} + 1 (mod {P}) = "
-                  f"{(delta - u - yhat.sum + 1) % P} zeros")
-            inspos = first_index_k_zeros_left(yhat, delta - u - yhat.sum + 1, P)
-
-        yhat = yhat._delete(inspos)
-        return yhead.concatenate(yhat).concatenate(ytail)
\ No newline at end of file
+            yhat_sum = ones[hi] - ones[lo]
+            inspos = first_index_k_zeros_left(y[lo:hi], delta - u - yhat_sum + 1, P)
+            
+        stats.event(verbose, "svt.insertion_position", ap=ap, delta=delta, inspos=inspos)
+        # As for np.delete, -1 is the last position of yhat
+        if not -(hi - lo) <= inspos < hi - lo:
+            raise Exception("No valid position found")
+        pos = lo + inspos % (hi - lo)
+        x = np.empty(n - 1, dtype=yv.dtype)
+        x[:pos] = yv[:pos]
+        x[pos:] = yv[pos+1:]
+        return y._like(x)
+    
+    def decode_deletion_batch(self, Y, a, u, P, delval, lengths=None):
+        """
+        decode_deletion for every row of Y. 
+        Y: 2-D binary array, one string per row, each with one symbol deleted
+        a, u, P, delval: per-row arrays (or scalars) of the decode_deletion arguments
+        lengths: optional lengths of the rows of Y, which are otherwise all
+                 Y.shape[1]
+        Return: (X, lengths) with X a 2-D array holding the decoded strings 
+                of length lengths+1, zero-padded
+        """
+        Y, n, a, u, P, val = self._batch_args(Y, lengths, a, u, P, delval)
+        q = np.minimum(P, n - u + 2)
+        lo, hi = u-1, u+q-2
+        ones, zeros, syn = self._batch_counts(Y, n)
+        rows = np.arange(Y.shape[0])
+        ap = (syn + ones[rows, n] - ones[rows, hi]) % P
+        delta = (a - ap) % P
+        
+        # First position to the left of delta ones in yhat (delval = 0), or 
+        # to the right of delta - u - wt(yhat) zeros (delval = 1)
+        k = np.where(val == 0, delta, delta - u - (ones[rows, hi] - ones[rows, lo]))
+        pos = self._batch_positions(ones, zeros, val, k, P, lo, hi)
+        
+        # Write each row shifted right by one past pos, with val at pos
+        cols = np.arange(Y.shape[1] + 1)
+        src = np.clip(cols - (cols > pos[:, None]), 0, max(Y.shape[1] - 1, 0))
+        X = np.zeros((Y.shape[0], Y.shape[1] + 1), dtype=Y.dtype)
+        if Y.shape[1] > 0:
+            X[:] = np.take_along_axis(Y, src, axis=1)
+        X[rows, pos] = val
+        X[cols >= (n + 1)[:, None]] = 0
+        return X, n + 1
+    
+    def decode_insertion_batch(self, Y, a, u, P, insval, lengths=None):
+        """
+        decode_insertion for every row of Y. 
+        Y: 2-D binary array, one string per row, each with one symbol inserted
+        a, u, P, insval: per-row arrays (or scalars) of the decode_insertion arguments
+        lengths: optional lengths of the rows of Y, which are otherwise all
+                 Y.shape[1]
+        Return: (X, lengths) with X a 2-D array holding the decoded strings 
+                of length lengths-1, zero-padded
+        """
+        Y, n, a, u, P, val = self._batch_args(Y, lengths, a, u, P, insval)
+        q = np.minimum(P, n - u + 1)
+        lo, hi = u-1, u+q-1
+        ones, zeros, syn = self._batch_counts(Y, n)
+        rows = np.arange(Y.shape[0])
+        ap = (syn - (ones[rows, n] - ones[rows, hi])) % P
+        delta = (ap - a) % P
+        
+        k = np.where(val == 0, delta, delta - u - (ones[rows, hi] - ones[rows, lo]) + 1)
+        pos = self._batch_positions(ones, zeros, val, k, P, lo, hi)
+        # Minus one for a zero, as in decode_insertion. 
+        # As for np.delete, -1 is then the last position of yhat
+        pos = pos - (val == 0)
+        if np.any((pos < lo - (hi - lo)) | (pos >= hi)):
+            raise Exception("No valid position found")
+        pos = lo + (pos - lo) % (hi - lo)
+        
+        # Write each row shifted left by one from pos
+        cols = np.arange(max(Y.shape[1] - 1, 0))
+        X = np.take_along_axis(Y, cols + (cols >= pos[:, None]), axis=1)
+        X[cols >= (n - 1)[:, None]] = 0
+        return X, n - 1
+    
+    @staticmethod
+    def _batch_positions(ones, zeros, val, k, P, lo, hi):
+        """
+        Absolute positions in [lo, hi] of the last with k (mod P) ones to 
+        the right (rows with val = 0) or the first with k (mod P) zeros to 
+        the left (rows with val = 1) within the window [lo, hi) of each row
+        """
+        pos = np.empty(val.shape[0], dtype=np.int64)
+        r = np.flatnonzero(val == 0)
+        ones_right = ones[r, hi[r]][:, None] - ones[r]
+        pos[r] = _first_matches(ones_right, k[r], P[r], lo[r], hi[r], last=True)
+        r = np.flatnonzero(val != 0)
+        zeros_left = zeros[r] - zeros[r, lo[r]][:, None]
+        pos[r] = _first_matches(zeros_left, k[r], P[r], lo[r], hi[r])
+        return pos
+    
+    @staticmethod
+    def _batch_args(Y, lengths, *args):
+        Y = np.asarray(Y)
+        B = Y.shape[0]
+        n = np.full(B, Y.shape[1], dtype=np.int64) if lengths is None else \
+            np.asarray(lengths, dtype=np.int64)
+        return (Y, n) + tuple(np.broadcast_to(np.asarray(v, dtype=np.int64), (B,)) for v in args)
+    
+    @staticmethod
+    def _batch_counts(Y, n):
+        """
+        ones[i, c], zeros[i, c]: number of ones/zeros in Y[i, :c] within the
+        row's length. syn[i]: VT syndrome of row i. 
+        """
+        valid = np.arange(Y.shape[1]) < n[:, None]
+        Yv = np.where(valid, Y, 0).astype(np.int64)
+        ones = np.zeros((Y.shape[0], Y.shape[1] + 1), dtype=np.int64)
+        zeros = np.zeros_like(ones)
+        np.cumsum(Yv == 1, axis=1, out=ones[:, 1:])
+        np.cumsum(valid & (Yv == 0), axis=1, out=zeros[:, 1:])
+        syn = Yv @ np.arange(1, Y.shape[1] + 1)
+        return ones, zeros, syn
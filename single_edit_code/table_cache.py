@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of the bucket tables precomputed by SumBalancedCode.
+
+File layout (all little-endian):
+    header      magic "SBCT", version, q, k, number of buckets nb,
+                width of each big integer in bytes, crc32 of the payload
+    payload     bucket2sumpair   (nb, 2) uint16
+                sumpair2bucket   (k+1, k+1) int32
+                bucket offsets   (nb+1) unsigned ints of `width` bytes each;
+                                 the last entry is the total number of
+                                 forbidden words
+
+Tables are memory-mapped on load, and big integers are only decoded when
+they are looked up.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+import numpy as np
+
+MAGIC = b"SBCT"
+VERSION = 1
+_HEADER = struct.Struct("<4sHHIIII")
+
+class PackedInts:
+    """
+    Read-only sequence of fixed-width little-endian unsigned integers
+    stored in a buffer.
+    """
+    def __init__(self, buf, length, width):
+        self.buf = buf
+        self.length = length
+        self.width = width
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if i < 0: i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError("PackedInts index out of range")
+        w = self.width
+        return int.from_bytes(self.buf[i*w:(i+1)*w], "little")
+
+class _Differences:
+    """
+    Read-only sequence of seq[i+1] - seq[i]
+    """
+    def __init__(self, seq):
+        self.seq = seq
+
+    def __len__(self):
+        return len(self.seq) - 1
+
+    def __getitem__(self, i):
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("_Differences index out of range")
+        return self.seq[i+1] - self.seq[i]
+
+def cache_path(cache_dir, k, q=4):
+    return os.path.join(cache_dir, f"sbcode_q{q}_k{k}_v{VERSION}.bin")
+
+def dump_buckets(code):
+    """
+    Serialize the bucket tables of a SumBalancedCode to bytes.
+    """
+    offsets = list(code.bucket2startidx) + [code._num_fwords]
+    width = max(1, (offsets[-1].bit_length() + 7) // 8)
+    payload = b"".join([
+        np.asarray(code.bucket2sumpair, dtype="<u2").tobytes(),
+        np.asarray(code.sumpair2bucket, dtype="<i4").tobytes(),
+        b"".join(x.to_bytes(width, "little") for x in offsets)
+    ])
+    header = _HEADER.pack(MAGIC, VERSION, code.q, code.k,
+                          len(code.bucket2size), width, zlib.crc32(payload))
+    return header + payload
+
+def load_buckets(code, buf):
+    """
+    Point the bucket tables of `code` at a buffer produced by dump_buckets.
+    The tables reference `buf` without copying it.
+    Raises ValueError if the buffer is corrupt or was built for another code.
+    """
+    buf = memoryview(buf)
+    if len(buf) < _HEADER.size:
+        raise ValueError("Truncated bucket table")
+    magic, version, q, k, nb, width, crc = _HEADER.unpack(buf[:_HEADER.size])
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a bucket table of a supported version")
+    if (q, k) != (code.q, code.k):
+        raise ValueError(f"Bucket table was built for q={q}, k={k}")
+    payload = buf[_HEADER.size:]
+    sizes = [4*nb, 4*(k+1)**2, width*(nb+1)]
+    if len(payload) != sum(sizes) or zlib.crc32(payload) != crc:
+        raise ValueError("Bucket table checksum mismatch")
+
+    offsets = PackedInts(payload[sizes[0]+sizes[1]:], nb+1, width)
+    code.bucket2sumpair = np.frombuffer(payload, dtype="<u2", count=2*nb).reshape(nb, 2)
+    code.sumpair2bucket = np.frombuffer(payload, dtype="<i4", count=(k+1)**2,
+                                        offset=sizes[0]).reshape(k+1, k+1)
+    code.bucket2startidx = PackedInts(offsets.buf, nb, width)
+    code.bucket2size = _Differences(offsets)
+    return code
+
+def _read_umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+# Read once; setting the umask affects files created by every thread
+_UMASK = _read_umask()
+
+def save_buckets(code, path):
+    """
+    Atomically write the bucket tables of `code` to `path`. The file gets 
+    the usual permissions of a new file (0o666 less the umask at import)
+    rather than the 0o600 of a temporary file, so that a shared cache 
+    directory can be read by other users. 
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(dump_buckets(code))
+            if hasattr(os, "fchmod"):
+                os.fchmod(f.fileno(), 0o666 & ~_UMASK)
+            else:
+                os.chmod(tmp, 0o666 & ~_UMASK)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def load_or_build(code, cache_dir):
+    """
+    Memory-map the cached bucket tables for `code` from cache_dir,
+    computing and saving them first if the cache is missing or invalid.
+    If the cache cannot be written, e.g. cache_dir is read-only or full,
+    the computed tables are used from memory. 
+    """
+    path = cache_path(cache_dir, code.k, code.q)
+    try:
+        with open(path, "rb") as f:
+            code._table_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return load_buckets(code, code._table_mmap)
+    except (OSError, ValueError):
+        code._table_mmap = None
+    code._compute_buckets()
+    try:
+        save_buckets(code, path)
+    except OSError:
+        pass
+    return code
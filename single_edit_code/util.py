@@ -5,7 +5,10 @@ Created on Sat Feb  8 00:10:55 2020
 @author: Daniel Tan
 """
 
+import hashlib
 import numpy as np
+from functools import lru_cache
+from math import gcd
 
 def syndrome(x):
     """
@@ -24,27 +27,243 @@ def signature(x):
 def parity_check(x):
     return np.sum(x) % 2
 
+@lru_cache(maxsize=64)
+def _weights(n):
+    """
+    Read-only int64 array [1, 2, ..., n], shared between calls
+    """
+    w = np.arange(1, n+1, dtype=np.int64)
+    w.flags.writeable = False
+    return w
+
+# Block length of checksums(), bounding its temporaries
+_CHECKSUM_BLOCK = 1 << 14
+
+def checksums(x, P=None, sig=None):
+    """
+    syndrome(x), syndrome(signature(x)), parity_check(signature(x)) and 
+    sum(x) in one pass over x in blocks, without building the signature 
+    as a QaryString. 
+    x:      numpy array of shape (n,)
+    P:      optional modulus applied to the signature syndrome
+    sig:    optional integer array of shape (n-1,) that receives the 
+            signature of x
+    Return: tuple of four Python ints
+    """
+    assert len(x.shape) == 1
+    n = x.shape[0]
+    a = b = c = d = 0
+    for start in range(0, n, _CHECKSUM_BLOCK):
+        stop = min(start + _CHECKSUM_BLOCK, n)
+        m = stop - start
+        xb = x[start:stop + 1].astype(np.int64)
+        s = np.greater_equal(xb[1:], xb[:-1], out=None if sig is None else sig[start:stop])
+        # Weights within the block, offset by start
+        w = _weights(_CHECKSUM_BLOCK)
+        sum_x, count_s = int(xb[:m].sum()), int(np.count_nonzero(s))
+        a += int(xb[:m] @ w[:m]) + start * sum_x
+        b += int(w[:s.shape[0]] @ s) + start * count_s
+        c += count_s
+        d += sum_x
+    return a, b % P if P else b, c % 2, d
+
+def checksums_batch(X, P=None):
+    """
+    checksums() of every row of the 2-D array X
+    Return: tuple of four int64 arrays of shape (X.shape[0],)
+    """
+    B, n = X.shape
+    if n == 0:
+        zero = np.zeros(B, dtype=np.int64)
+        return zero, zero, zero, zero
+    X = X.astype(np.int64, copy=False)
+    w = _weights(n)
+    sig = np.empty((B, n - 1), dtype=np.int64)
+    np.greater_equal(X[:, 1:], X[:, :-1], out=sig)
+    b = sig @ w[:-1]
+    return (X @ w, b % P if P else b,
+            np.count_nonzero(sig, axis=1) % 2, X.sum(axis=1))
+
 def multiplicative_inverse(a, n):
     """
-    Return b such that ab = 1 (mod n)
+    Return b such that ab = 1 (mod n), by the extended Euclidean algorithm
+    """
+    r0, r1 = n, a % n
+    s0, s1 = 0, 1
+    while r1 != 0:
+        quot = r0 // r1
+        r0, r1 = r1, r0 - quot * r1
+        s0, s1 = s1, s0 - quot * s1
+    if r0 != 1 or n == 1:
+        raise Exception(f"{a} has no inverse modulo {n}")
+    return s0 % n
+
+@lru_cache(maxsize=1024)
+def small_inverses(n, q=4):
+    """
+    For every v with 0 < |v| < q, the pair (g, b) where g = gcd(v, n) and b
+    is the inverse of v/g modulo n/g. Solutions of v*j = c (mod n) are then
+    j = (c/g)*b (mod n/g) when g divides c. 
     """
-    for b in range(n):
-        if a * b % n == 1: return b
-    # Should never get here
-    raise Exception()
+    inverses = {}
+    for v in range(1 - q, q):
+        if v == 0: continue
+        g = gcd(v, n)
+        inverses[v] = (g, multiplicative_inverse(v // g, n // g) if n // g > 1 else 0)
+    return inverses
      
+def to_digits(x, width, q=4):
+    """
+    Vectorized base-q expansion, most significant digit first. 
+    x: numpy integer array of shape (B,)
+    Return: numpy array of shape (B, width)
+    """
+    powers = q ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    return (np.asarray(x, dtype=np.int64)[:, None] // powers) % q
+
+def from_digits(d, q=4):
+    """
+    Inverse of to_digits. d: numpy array of shape (B, width)
+    """
+    powers = q ** np.arange(d.shape[1] - 1, -1, -1, dtype=np.int64)
+    return d.astype(np.int64) @ powers
+
+@lru_cache(maxsize=64)
+def _chunk_width(q):
+    """
+    Largest c such that c base-q digits always fit in an int64
+    """
+    c = 1
+    while q ** (c + 1) <= 2**63:
+        c += 1
+    return c
+
+def int_from_digits(d, q=4):
+    """
+    Python int whose base-q expansion, most significant digit first, is d. 
+    Digits are converted c at a time with numpy, where c digits fit in an
+    int64, and the chunks combined as Python ints. 
+    d: numpy array of shape (n,)
+    """
+    d = np.asarray(d, dtype=np.int64)
+    c = _chunk_width(q)
+    head = d.shape[0] % c
+    x = int(from_digits(d[None, :head], q)[0]) if head else 0
+    if d.shape[0] > head:
+        base = q ** c
+        for v in from_digits(d[head:].reshape(-1, c), q).tolist():
+            x = x * base + v
+    return x
+
+def int_to_digits(x, q=4):
+    """
+    Base-q expansion of the Python int x, most significant digit first and
+    without leading zeros; empty for x <= 0. 
+    Return: numpy int64 array
+    """
+    if x <= 0:
+        return np.zeros(0, dtype=np.int64)
+    c = _chunk_width(q)
+    base = q ** c
+    chunks = []
+    while x:
+        x, r = divmod(x, base)
+        chunks.append(r)
+    d = to_digits(np.array(chunks[::-1], dtype=np.int64), c, q).reshape(-1)
+    return d[np.flatnonzero(d)[0]:]
+
+_KEYSTREAM_SEED = b"single_edit_code whitening"
+
+def keystream(n, q=4):
+    """
+    Fixed pseudorandom sequence of n symbols in {0..q-1}, the first n of an
+    endless stream: SHAKE-128 of a constant seed, taken 2 bits per symbol.
+    Used to whiten strings before sum-balancing. 
+    Return: numpy int8 array of shape (n,)
+    """
+    if q != 4:
+        raise Exception("keystream() requires q = 4")
+    return unpack_2bit(np.frombuffer(hashlib.shake_128(_KEYSTREAM_SEED).digest(-(-n // 4)), 
+                                     dtype=np.uint8), n)
+
+def pack_2bit(x):
+    """
+    Pack symbols in {0,1,2,3} four to a byte, first symbol in the most 
+    significant bits. Unused bits of the last byte are zero. 
+    x: numpy array of shape (n,)
+    Return: numpy uint8 array of shape (ceil(n/4),)
+    """
+    n = x.shape[0]
+    padded = np.zeros(-(-n // 4) * 4, dtype=np.uint8)
+    padded[:n] = x
+    padded = padded.reshape(-1, 4)
+    return (padded[:, 0] << 6) | (padded[:, 1] << 4) | (padded[:, 2] << 2) | padded[:, 3]
+
+def unpack_2bit(data, n):
+    """
+    Inverse of pack_2bit. Return: numpy int8 array of shape (n,)
+    """
+    shifts = np.array([6, 4, 2, 0], dtype=np.uint8)
+    x = (np.asarray(data, dtype=np.uint8)[:, None] >> shifts) & 3
+    return x.reshape(-1)[:n].astype(np.int8)
+
+# Per-byte lookup tables over packed data: the four symbols of each byte, 
+# their sum, their sum weighted by position within the byte, and the
+# signature bits between them.
+_BYTE_SYMBOLS = unpack_2bit(np.arange(256), 1024).reshape(256, 4).astype(np.int64)
+_BYTE_SUM = _BYTE_SYMBOLS.sum(axis=1)
+_BYTE_WEIGHTED_SUM = _BYTE_SYMBOLS @ np.arange(4)
+_BYTE_SIGNATURE = _BYTE_SYMBOLS[:, 1:] >= _BYTE_SYMBOLS[:, :-1]
+
+def packed_sum(data):
+    return int(_BYTE_SUM[data].sum())
+
+def packed_syndrome(data):
+    """
+    syndrome() of the string packed in data. Zero padding does not 
+    contribute to the sum. 
+    """
+    j = np.arange(data.shape[0], dtype=np.int64)
+    return int(((4*j + 1) * _BYTE_SUM[data] + _BYTE_WEIGHTED_SUM[data]).sum())
+
+def packed_signature(data, n):
+    """
+    signature() of the length-n string packed in data
+    """
+    sig = np.empty((data.shape[0], 4), dtype=bool)
+    sig[:, :3] = _BYTE_SIGNATURE[data]
+    sig[:-1, 3] = (data[1:] >> 6) >= (data[:-1] & 3)
+    return sig.reshape(-1)[:max(n - 1, 0)]
+
 def is_sum_balanced(x, q=4):
     k = x.shape[0]
     return (q // 2 - 1) * k < np.sum(x) < (q // 2)*k
 
+def window_sums(x, k):
+    """
+    Sums of all n-k+1 windows of length k of x, from a cumulative sum
+    x: numpy array of shape (n,)
+    Return: int64 numpy array, window i being x[i:i+k]
+    """
+    c = np.zeros(x.shape[0] + 1, dtype=np.int64)
+    np.cumsum(x, out=c[1:])
+    return c[k:] - c[:c.shape[0] - k]
+
+def forbidden_windows(x, k, q=4):
+    """
+    x: numpy array of shape (n,), in a q-ary alphabet. 
+    k: Length of window over which we compute sum-balancedness
+    Return: int numpy array of the start positions of all windows of 
+            length k which are not sum-balanced, in increasing order
+    """
+    if x.shape[0] < k:
+        return np.zeros(0, dtype=np.int64)
+    sums = window_sums(x, k)
+    return np.flatnonzero((sums <= (q // 2 - 1) * k) | (sums >= (q // 2) * k))
+
 def is_k_sum_balanced(x, k, q=4):
     """
     x: numpy array of shape (n,), in a q-ary alphabet. 
     k: Length of window over which we compute sum-balancedness
     """
-    n = x.shape[0]
-    for i in range(n+1-k):
-        window = x[i:i+k]
-        if not is_sum_balanced(window, q):
-            return False
-    return True
\ No newline at end of file
+    return forbidden_windows(x, k, q).shape[0] == 0
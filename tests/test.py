@@ -7,8 +7,28 @@ Created on Tue Feb  4 23:52:06 2020
 
 import single_edit_code as sec
 import unittest
+import tempfile
+import os
+import io
+import subprocess
+import sys
 import numpy as np
 
+class TestImports(unittest.TestCase):
+    def test_lazy_and_scipy_free(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(sec.__file__)))
+        script = ("import sys, single_edit_code as sec\n"
+                  "assert 'single_edit_code.sum_balanced_code' not in sys.modules\n"
+                  "sec.SingleEditCode(16)\n"
+                  "print('scipy' in sys.modules)")
+        out = subprocess.run([sys.executable, "-c", script], cwd=root, 
+                             capture_output=True, text=True, check=True).stdout
+        self.assertEqual(out.strip(), "False")
+        with self.assertRaises(AttributeError):
+            sec.no_such_name
+        self.assertEqual(sec.binom(30, 12), 86493225)
+        self.assertEqual(sec.binom(3, 5), 0)
+
 class TestSyndrome(unittest.TestCase):
     def test1(self):
         x = np.array([0,0,1])
@@ -20,6 +40,124 @@ class TestSignature(unittest.TestCase):
         result = np.all(sec.util.signature(x) == np.array([False, True]))
         self.assertTrue(result)
         
+class TestMultiplicativeInverse(unittest.TestCase):
+    def test_inverse(self):
+        for n in range(2, 300):
+            for a in range(n):
+                if np.gcd(a, n) == 1:
+                    self.assertEqual(a * sec.util.multiplicative_inverse(a, n) % n, 1)
+                else:
+                    with self.assertRaises(Exception):
+                        sec.util.multiplicative_inverse(a, n)
+                        
+    def test_substitution_positions(self):
+        code = sec.SingleEditCode(32)
+        x = sec.QaryString(4, np.random.randint(low=0, high=4, size=300))
+        x_enc, n, N, l = code.encode(x)
+        for pos in range(n):
+            for symbol in range(4):
+                if symbol != x_enc.val[pos]:
+                    x_enc_m = x_enc._substitute(pos, symbol)
+                    self.assertTrue(code.decode(x_enc_m, n, N, l) == x)
+                    
+    def test_substitution_with_corrupt_r4(self):
+        code = sec.SingleEditCode(32)
+        x = sec.QaryString(4, np.random.randint(low=0, high=4, size=200))
+        x_enc, n, N, l = code.encode(x)
+        y = x_enc._substitute(5, (x_enc.val[5] + 1) % 4)
+        for r4 in range(16):
+            # A second error, in the check symbols R4
+            y_m = y._substitute(N-2, r4 // 4)._substitute(N-1, r4 % 4)
+            try:
+                code.decode(y_m, n, N, l)
+            except Exception as e:
+                self.assertIs(type(e), Exception)
+                    
+class TestChecksums(unittest.TestCase):
+    def test_matches_separate_checksums(self):
+        for n in [1, 2, 3, 50, 40000]:
+            x = sec.QaryString(4, np.random.randint(low=0, high=4, size=n).astype(np.int8))
+            sig = np.empty(n - 1, dtype=np.int8)
+            expected = (x.syndrome, x.signature.syndrome % 1280, x.signature.parity_check, x.sum)
+            self.assertEqual(sec.util.checksums(x.val, 1280, sig=sig), 
+                             tuple(int(v) for v in expected))
+            self.assertTrue(np.all(sig == x.signature.val))
+            
+    def test_batch(self):
+        X = np.random.randint(low=0, high=4, size=(20, 70))
+        batch = sec.util.checksums_batch(X, 1280)
+        for i in range(20):
+            self.assertEqual(tuple(int(v[i]) for v in batch), sec.util.checksums(X[i], 1280))
+
+class TestBaseConversion(unittest.TestCase):
+    def test_int_roundtrip(self):
+        for q in [2, 3, 4, 7, 16]:
+            for bits in [0, 1, 10, 62, 63, 64, 200, 1100]:
+                x = int(np.random.randint(1, 2**31)) << bits
+                qstr = sec.QaryString(q).fromint(x)
+                self.assertEqual(qstr.asint(), x)
+                self.assertEqual(sum(int(v) * q**i for i, v in enumerate(qstr.val[::-1])), x)
+                self.assertNotEqual(qstr.val[0], 0)
+        self.assertEqual(sec.QaryString(4).fromint(0).length, 0)
+        self.assertEqual(sec.QaryString(4, []).asint(), 0)
+        
+    def test_binary_matrix(self):
+        for q in [2, 4, 8]:
+            x = sec.QaryString(q, np.random.randint(low=0, high=q, size=50))
+            _, m = x.as_binary_matrix
+            self.assertEqual(m.shape, (50, int(np.log2(q))))
+            self.assertTrue(np.all(m @ (1 << np.arange(m.shape[1]))[::-1] == x.val))
+            self.assertTrue(sec.QaryString.from_binary_matrix(q, m) == x)
+
+class TestLengthPlan(unittest.TestCase):
+    def test_bounds(self):
+        for k in [32, 64, 128, 256]:
+            code = sec.SingleEditCode(k)
+            for l in [10, 150, 400, 1000]:
+                if sum(code.sbcode._block_lengths(l)) > k and l + 1 >= k:
+                    # Blocks longer than k: n is not bounded
+                    with self.assertRaises(Exception):
+                        code.plan(l)
+                    continue
+                plan = code.plan(l)
+                inputs = [np.zeros(l, dtype=int), np.full(l, 3), np.ones(l, dtype=int),
+                          np.resize(np.repeat([0, 3], k), l), 
+                          np.resize(np.repeat([0, 3], k // 2), l)]
+                inputs += [np.random.randint(low=0, high=4, size=l) for i in range(5)]
+                lengths = []
+                for x in inputs:
+                    x_enc, n, N, _ = code.encode(sec.QaryString(4, x))
+                    self.assertTrue(plan.n_lower <= n <= plan.n_max)
+                    self.assertTrue(plan.N_lower <= N <= plan.N_max)
+                    self.assertEqual(N, code.codeword_length(n))
+                    lengths.append(n)
+                # Runs of k/2 0s and 3s have no forbidden windows
+                self.assertEqual(lengths[4], plan.n_max)
+                if l + 1 < k:
+                    self.assertEqual(plan.n_lower, plan.n_max)
+        self.assertEqual(sec.SingleEditCode(64).plan(200).n_max, 201)
+        with self.assertRaises(Exception):
+            sec.SingleEditCode(64).plan(1000)
+                    
+    def test_plan_table(self):
+        code = sec.SingleEditCode(64)
+        table = code.plan_table(range(100, 110))
+        self.assertEqual(sorted(table), list(range(100, 110)))
+        self.assertEqual(table[105], code.plan(105))
+        
+    def test_fixed_length(self):
+        code = sec.SingleEditCode(128, fixed_length=True)
+        plan = code.plan(200)
+        self.assertEqual(plan.N_lower, plan.N_max)
+        for i in range(30):
+            x = sec.QaryString(4, np.random.randint(low=0, high=4, size=200) if i % 2 else np.full(200, i % 4))
+            x_enc, n, N, l = code.encode(x)
+            self.assertEqual(N, plan.N_max)
+            x_enc_m = x_enc.mutate()[0]
+            self.assertTrue(code.decode_fixed(x_enc_m, 200) == x)
+        with self.assertRaises(Exception):
+            sec.SingleEditCode(64, fixed_length=True).plan(1000)
+
 class TestSumBalanced(unittest.TestCase):
     def test1_sum_balanced(self):
         x = np.array([0,0,0,1,1,1])
@@ -31,11 +169,80 @@ class TestkSumBalanced(unittest.TestCase):
         self.assertFalse(sec.util.is_k_sum_balanced(np.arange(4), 1))
         self.assertTrue(sec.util.is_k_sum_balanced(np.array([1,1,2,2,1,1,2,2]), 3))
         
+    def test_forbidden_windows(self):
+        for i in range(200):
+            x = np.random.randint(low=0, high=4, size=np.random.randint(0, 40))
+            k = np.random.randint(1, 10)
+            expected = [j for j in range(len(x) + 1 - k) if not sec.util.is_sum_balanced(x[j:j+k])]
+            self.assertEqual(sec.util.forbidden_windows(x, k).tolist(), expected)
+            self.assertEqual(sec.util.is_k_sum_balanced(x, k), not expected)
+        
+class TestQaryView(unittest.TestCase):
+    def test_views_and_copy_on_write(self):
+        a = np.random.randint(low=0, high=4, size=100).astype(np.int8)
+        x = sec.QaryView(4, a)
+        self.assertFalse(hasattr(x, "__dict__"))
+        self.assertTrue(np.shares_memory(x.val, a))
+        self.assertTrue(x == sec.QaryString(4, a))
+        parts = x.split([10, 50, 40])
+        for part in parts:
+            self.assertTrue(isinstance(part, sec.QaryView))
+            self.assertTrue(np.shares_memory(part.val, a))
+        y = parts[1]
+        y[0] = (a[10] + 1) % 4
+        self.assertEqual(y.val[0], (a[10] + 1) % 4)
+        self.assertNotEqual(x.val[10], y.val[0])
+        x[20] = (a[20] + 1) % 4
+        self.assertNotEqual(a[20], x.val[20])
+        self.assertEqual(parts[1].val[10], a[20])
+        with self.assertRaises(ValueError):
+            parts[2].val[0] = 0
+
+    def test_operations(self):
+        a = np.random.randint(low=0, high=4, size=30)
+        x, v = sec.QaryString(4, a), sec.QaryView(4, a)
+        self.assertEqual(v.val.dtype, np.int8)
+        for f in [lambda s: s._insert(3, 2), lambda s: s._delete(7), lambda s: s._substitute(5, 1),
+                  lambda s: s.concatenate([s[:4]]), lambda s: s.signature, lambda s: s[2]]:
+            self.assertTrue(isinstance(f(v), sec.QaryView))
+            self.assertTrue(f(v) == f(x))
+            self.assertTrue(type(f(x)) is sec.QaryString)
+        w = v._insert(0, 3)
+        w[1] = 0
+        self.assertTrue(v == x)
+
+class TestPackedQaryString(unittest.TestCase):
+    def test_matches_unpacked(self):
+        for i in range(300):
+            n = np.random.randint(0, 40)
+            x = sec.QaryString(4, np.random.randint(low=0, high=4, size=n))
+            p = x.pack()
+            self.assertTrue(p == x and p.unpack() == x)
+            self.assertEqual(len(p), n)
+            self.assertEqual(p.data.nbytes, -(-n // 4))
+            self.assertEqual(p.sum, x.sum)
+            self.assertEqual(p.syndrome, x.syndrome)
+            self.assertTrue(p.signature == x.signature)
+            a, b = sorted(np.random.randint(0, n+1, size=2))
+            self.assertTrue(p[a:b] == x[a:b])
+            self.assertEqual(p[a:b].syndrome, x[a:b].syndrome)
+            for part_p, part_x in zip(p.split([a, b-a, n-b]), x.split([a, b-a, n-b])):
+                self.assertTrue(part_p == part_x)
+                
+    def test_encoding_unchanged(self):
+        code = sec.SingleEditCode(32)
+        x = sec.QaryString(4, np.random.randint(low=0, high=4, size=200))
+        x_enc, n, N, l = code.encode(x)
+        x_enc_p, n_p, N_p, l_p = code.encode(x.pack())
+        self.assertTrue(x_enc == x_enc_p)
+        self.assertEqual((n, N, l), (n_p, N_p, l_p))
+        self.assertTrue(code.decode(x_enc.pack(), n, N, l) == x)
+        
 class TestSingleEditCode(unittest.TestCase):            
     def test_comprehensive(self):
         code = sec.SingleEditCode()
         for i in range(1000):
-            x = sec.QaryString(4, np.random.randint(4, 1024))
+            x = sec.QaryString(4, np.random.randint(low=0, high=4, size=np.random.randint(1, 1024)))
             x_enc, n, N, l = code.encode(x)
             x_enc_m, mtype, pos, symbol = x_enc.mutate(mtype="insert")
             x_pred = code.decode(x_enc_m, n, N, l)
@@ -44,13 +251,259 @@ class TestSingleEditCode(unittest.TestCase):
     def test_very_large_k(self):
         code = sec.SingleEditCode(512)
         for i in range(1000):
-            x = sec.QaryString(4, np.random.randint(4, 1024))
+            x = sec.QaryString(4, np.random.randint(low=0, high=4, size=np.random.randint(1, 1024)))
             x_enc, n, N, l = code.encode(x)
             x_enc_m, mtype, pos, symbol = x_enc.mutate(mtype="insert")
             x_pred = code.decode(x_enc_m, n, N, l)
             self.assertTrue(x_pred == x)
             
 
+class TestIndelLocalisation(unittest.TestCase):
+    def brute_force(self, s, t):
+        return [jp for jp in range(1, len(s)+1) if np.all(np.delete(s, jp-1) == t)]
+    
+    def test_windows_match_brute_force(self):
+        m = sec.single_edit_code
+        for i in range(300):
+            n = np.random.randint(2, 12)
+            xp = np.random.randint(0, np.random.choice([2, 4]), size=n-1)
+            sym = np.random.randint(0, 4)
+            t = sec.util.signature(xp).astype(np.int8)
+            for p in range(n):
+                s = sec.util.signature(np.insert(xp, p, sym)).astype(np.int8)
+                lo, hi = m._deletion_window(t, m._runs(t), m._deletion_patch(xp, sym, p), p)
+                self.assertEqual(self.brute_force(s, t), list(range(lo, hi+1)))
+            xp = np.random.randint(0, np.random.choice([2, 4]), size=n+1)
+            s = sec.util.signature(xp).astype(np.int8)
+            for p in range(n+1):
+                t = sec.util.signature(np.delete(xp, p)).astype(np.int8)
+                lo, hi = m._insertion_window(s, m._runs(s), m._insertion_patch(xp, p), p)
+                self.assertEqual(self.brute_force(s, t), list(range(lo, hi+1)))
+                
+    def test_long_strands(self):
+        code = sec.SingleEditCode(64)
+        for length in [1, 10, 500, 3000]:
+            x = sec.QaryString(4, np.random.randint(low=0, high=4, size=length))
+            x_enc, n, N, l = code.encode(x)
+            for mtype in ["insert", "delete", "substitute"]:
+                for i in range(5):
+                    x_enc_m = x_enc.mutate(mtype=mtype)[0]
+                    self.assertTrue(code.decode(x_enc_m, n, N, l) == x)
+                    
+class TestSingleEditCodeBatch(unittest.TestCase):
+    def test_batch_matches_single(self):
+        code = sec.SingleEditCode(32)
+        X = np.random.randint(low=0, high=4, size=(100, 80)).astype(np.uint8)
+        X[::5] = 0
+        X_enc, n, N, l = code.encode_batch(X)
+        received = []
+        for i in range(len(X)):
+            x_enc, n_i, N_i, l_i = code.encode(sec.QaryString(4, X[i]))
+            self.assertEqual((n_i, N_i, l_i), (n[i], N[i], l[i]))
+            self.assertTrue(x_enc == sec.QaryString(4, X_enc[i, :N[i]]))
+            mtype = ["none", "substitute", "insert", "delete"][i % 4]
+            received.append(x_enc.val if mtype == "none" else x_enc.mutate(mtype)[0].val)
+        X_dec, l_dec = code.decode_batch(received, n, N, l)
+        self.assertTrue(np.all(X_dec == X))
+        self.assertTrue(np.all(l_dec == l))
+        
+    def test_ragged(self):
+        code = sec.SingleEditCode(32)
+        X = [np.random.randint(low=0, high=4, size=np.random.randint(1, 100)) for i in range(30)]
+        X_enc, n, N, l = code.encode_batch(X)
+        X_dec, l_dec = code.decode_batch(X_enc, n, N, l, lengths=N)
+        for i, x in enumerate(X):
+            self.assertTrue(np.all(X_dec[i, :l_dec[i]] == x))
+        with self.assertRaises(ValueError):
+            code.decode_batch(X_enc, n, N, l)
+            
+class TestSingleEditCodePool(unittest.TestCase):
+    def test_pool_keeps_order_and_reports_failures(self):
+        X = [np.random.randint(low=0, high=4, size=np.random.randint(1, 100)) for i in range(40)]
+        with sec.SingleEditCodePool(32, processes=2, chunksize=7) as pool:
+            encoded = pool.encode(X)
+            received = [sec.QaryString(4, r[0]).mutate()[0].val for r in encoded]
+            received[11] = np.zeros(3)
+            n, N, l = ([r[i] for r in encoded] for i in (1, 2, 3))
+            decoded = pool.decode(received, n, N, l)
+        for i, x in enumerate(X):
+            if i == 11:
+                self.assertIsInstance(decoded[i], sec.ItemError)
+                self.assertEqual(decoded[i].index, 11)
+            else:
+                self.assertTrue(np.all(decoded[i] == x))
+                
+    def test_fixed_length(self):
+        X = [np.random.randint(low=0, high=4, size=200) if i % 2 else np.full(200, i % 4) 
+             for i in range(12)]
+        with sec.SingleEditCodePool(128, processes=2, fixed_length=True) as pool:
+            encoded = pool.encode(X)
+            N_max = pool.code.plan(200).N_max
+            self.assertEqual([r[2] for r in encoded], [N_max] * 12)
+            for x, r in zip(X, encoded):
+                y = sec.QaryString(4, r[0]).mutate()[0]
+                self.assertTrue(np.all(pool.code.decode_fixed(y, 200).val == x))
+            
+    def test_failed_start_releases_shared_memory(self):
+        from unittest import mock
+        from multiprocessing import shared_memory
+        created = []
+        class Recorded(shared_memory.SharedMemory):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                created.append(self.name)
+        context = mock.Mock()
+        context.Pool.side_effect = OSError("cannot start workers")
+        with mock.patch.object(sec.parallel.shared_memory, "SharedMemory", Recorded):
+            with self.assertRaises(OSError):
+                sec.SingleEditCodePool(16, processes=1, mp_context=context)
+        self.assertEqual(len(created), 1)
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=created[0])
+            
+    def test_spawn_workers_exit_cleanly(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(sec.__file__)))
+        script = ("import multiprocessing, numpy as np, single_edit_code as sec\n"
+                  "if __name__ == '__main__':\n"
+                  "    X = [np.random.randint(0, 4, size=50) for i in range(10)]\n"
+                  "    ctx = multiprocessing.get_context('spawn')\n"
+                  "    with sec.SingleEditCodePool(32, processes=2, mp_context=ctx) as pool:\n"
+                  "        r = pool.encode(X)\n"
+                  "        d = pool.decode(*([e[i] for e in r] for i in range(4)))\n"
+                  "    print(all(np.all(a == b) for a, b in zip(X, d)))\n")
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "spawn_pool.py")
+            with open(path, "w") as f:
+                f.write(script)
+            env = dict(os.environ, PYTHONPATH=root)
+            out = subprocess.run([sys.executable, path], cwd=root, env=env,
+                                 capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.strip(), "True")
+        self.assertEqual(out.stderr, "")
+
+class TestStats(unittest.TestCase):
+    def test_records_only_when_enabled(self):
+        code = sec.SingleEditCode(32)
+        x = sec.QaryString(4, np.zeros(300, dtype=int))
+        x_enc, n, N, l = code.encode(x)
+        with sec.Stats() as stats:
+            code.encode(x)
+            for y in [x_enc._delete(10), x_enc._insert(10, 3)]:
+                self.assertTrue(code.decode(y, n, N, l) == x)
+        self.assertIsNone(sec.stats.active())
+        code.decode(x_enc.mutate("delete")[0], n, N, l)
+        h = stats.histograms
+        self.assertEqual(h["sum_balance.replacements"].count, 1)
+        self.assertGreater(h["sum_balance.replacements"].max, 0)
+        self.assertEqual(h["sum_balance.rewind"].count, h["sum_balance.replacements"].total)
+        for name in ["deletion.Js", "insertion.Js", "deletion.Jp", "insertion.Jp"]:
+            self.assertEqual(h[name].count, 1)
+        self.assertGreaterEqual(h["deletion.Js"].min, 1)
+        for name in ["time.sum_balance", "time.checksums", "time.svt", "time.unbalance"]:
+            self.assertIn(name, h)
+        self.assertEqual([e["event"] for e in stats.events if e["event"] == "decode"], ["decode"] * 2)
+        with tempfile.TemporaryDirectory() as d:
+            stats.dump(os.path.join(d, "stats.json"))
+
+    def test_per_thread(self):
+        import threading
+        code = sec.SingleEditCode(32)
+        x = sec.QaryString(4, np.zeros(300, dtype=int))
+        x_enc, n, N, l = code.encode(x)
+        y = x_enc._delete(10)
+        own = []
+        def other():
+            with sec.Stats() as stats:
+                code.decode(y, n, N, l)
+            own.append(stats)
+            code.decode(y, n, N, l)
+        with sec.Stats() as stats:
+            thread = threading.Thread(target=other)
+            thread.start()
+            thread.join()
+        self.assertEqual(stats.histograms, {})
+        self.assertEqual(own[0].histograms["deletion.Js"].count, 1)
+        self.assertIsNone(sec.stats.active())
+        
+    def test_jp_counts_union_of_windows(self):
+        with sec.Stats() as stats:
+            sec.single_edit_code._observe_candidates("deletion", [1, 2, 3], [(10, 12), (1, 3), (2, 5)])
+            sec.single_edit_code._observe_candidates("deletion", [], [])
+        h = stats.histograms["deletion.Jp"]
+        self.assertEqual((h.max, h.min), (8, 0))
+
+class TestChannel(unittest.TestCase):
+    def test_inject_errors(self):
+        rng = np.random.default_rng(1)
+        lengths = rng.integers(0, 30, size=500)
+        X = rng.integers(0, 4, size=(500, 30))
+        rates = {"substitution": 0.3, "insertion": 0.3, "deletion": 0.3}
+        Y, received, types, positions = sec.inject_errors(X, lengths, rates, rng)
+        for i in range(500):
+            x, y = sec.QaryString(4, X[i, :lengths[i]]), sec.QaryString(4, Y[i, :received[i]])
+            self.assertTrue(np.all(Y[i, received[i]:] == 0))
+            t, pos = sec.ERROR_TYPES[types[i]], positions[i]
+            if t == "none":
+                self.assertTrue(y == x)
+            elif t == "substitution":
+                self.assertNotEqual(y.val[pos], x.val[pos])
+                self.assertTrue(x._substitute(pos, y.val[pos]) == y)
+            elif t == "insertion":
+                self.assertTrue(x._insert(pos, y.val[pos]) == y)
+            else:
+                self.assertTrue(x._delete(pos) == y)
+        self.assertEqual(set(types[lengths == 0]) - {0, 2}, set())
+
+    def test_simulate(self):
+        code = sec.SingleEditCode(32)
+        rates = {"substitution": 0.25, "insertion": 0.25, "deletion": 0.25}
+        report = sec.simulate(code, 100, 200, rates, seed=3, batch_size=64)
+        self.assertEqual(report.trials, 200)
+        self.assertEqual(report.success_rate, 1.0)
+        self.assertEqual(sum(report.trials_by_type.values()), 200)
+        self.assertEqual(sum(report.failures_by_type.values()), 0)
+        self.assertTrue(report.latency_us[50] <= report.latency_us[99])
+        with sec.SingleEditCodePool(32, processes=2) as pool:
+            pooled = sec.simulate(pool, 100, 200, rates, seed=3, batch_size=64)
+        self.assertEqual(pooled.trials_by_type, report.trials_by_type)
+        self.assertEqual(pooled.success_rate, 1.0)
+        empty = sec.simulate(code, 100, 0, rates)
+        self.assertEqual(empty.trials, 0)
+        self.assertTrue(np.isnan(empty.success_rate) and np.isnan(empty.latency_us[99]))
+        self.assertEqual(sum(empty.trials_by_type.values()), 0)
+
+class TestStream(unittest.TestCase):
+    def test_file_roundtrip_with_edits(self):
+        code = sec.SingleEditCode(32)
+        data = np.random.randint(0, 256, size=1003).astype(np.uint8).tobytes()
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "payload.bin")
+            with open(path, "wb") as f:
+                f.write(data)
+            frames = []
+            for frame in sec.encode_file(path, code, message_length=80, chunk_size=64):
+                self.assertTrue(frame.l == 80 or frame.index == len(data) // 20)
+                frames.append(frame._replace(codeword=frame.codeword.mutate()[0]))
+            self.assertEqual(len(frames), -(-len(data) // 20))
+            written = sec.decode_to_file(frames, code, path + ".out", batch_size=16)
+            self.assertEqual(written, len(data))
+            with open(path + ".out", "rb") as f:
+                self.assertEqual(f.read(), data)
+                
+    def test_empty_stream(self):
+        code = sec.SingleEditCode(32)
+        self.assertEqual(list(sec.encode_stream(io.BytesIO(b""), code)), [])
+        
+    def test_missing_frame(self):
+        code = sec.SingleEditCode(32)
+        frames = list(sec.encode_stream(io.BytesIO(bytes(range(200))), code, message_length=40))
+        self.assertEqual(b"".join(sec.decode_stream(frames, code)), bytes(range(200)))
+        for lost in [0, 7]:
+            with self.assertRaises(Exception):
+                list(sec.decode_stream(frames[:lost] + frames[lost+1:], code, batch_size=4))
+        with self.assertRaises(Exception):
+            list(sec.decode_stream(frames[1:2] + frames[:1] + frames[2:], code))
+        
 class TestSVTCode(unittest.TestCase):
     def test1_delete_fixed_short(self):
         y = sec.QaryString(q=2, val=[0,1,0,1,0,1,0,1])
@@ -110,6 +563,164 @@ class TestSVTCode(unittest.TestCase):
             y_pred = code.decode_insertion(yp, y.syndrome, u, 10, symbol, verbose=False)
             self.assertTrue(y_pred == y)
             
+class TestPickle(unittest.TestCase):
+    def test_code_roundtrip(self):
+        import pickle, copy
+        x = sec.QaryString(4, np.zeros(300, dtype=int))
+        with tempfile.TemporaryDirectory() as d:
+            # The last code memory-maps the tables saved by the one before it
+            for code in [sec.SingleEditCode(32), sec.SingleEditCode(32, cache_dir=d),
+                         sec.SingleEditCode(32, cache_dir=d, whiten=True)]:
+                x_enc, n, N, l = code.encode(x)
+                for other in [pickle.loads(pickle.dumps(code)), copy.deepcopy(code)]:
+                    self.assertIs(other.sbcode._rank_cache.__wrapped__.__self__, other.sbcode)
+                    self.assertTrue(other.encode(x)[0] == x_enc)
+                    self.assertTrue(other.decode(x_enc.mutate()[0], n, N, l) == x)
+            
+    def test_qary_strings(self):
+        import pickle
+        a = np.random.randint(low=0, high=4, size=37)
+        for x in [sec.QaryString(4, a), sec.QaryView(4, a), sec.PackedQaryString(4, a)]:
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                y = pickle.loads(pickle.dumps(x, protocol=protocol))
+                self.assertIs(type(y), type(x))
+                self.assertTrue(y == x)
+        
+    def test_pickles_from_before_slots(self):
+        import pickle
+        # [QaryString(4, [0, 1, 2, 3, 3, 1]), QaryString(2, [1, 0])], pickled
+        # with protocol 2 by the baseline QaryString, which had a __dict__
+        old = (b'\x80\x02]q\x00(csingle_edit_code.qary_string\nQaryString\nq\x01)\x81q\x02}q\x03(X'
+               b'\x01\x00\x00\x00qq\x04K\x04X\x03\x00\x00\x00valq\x05cnumpy.core.multiarray\n_rec'
+               b'onstruct\nq\x06cnumpy\nndarray\nq\x07K\x00\x85q\x08c_codecs\nencode\nq\tX\x01\x00'
+               b'\x00\x00bq\nX\x06\x00\x00\x00latin1q\x0b\x86q\x0cRq\r\x87q\x0eRq\x0f(K\x01K\x06\x85'
+               b'q\x10cnumpy\ndtype\nq\x11X\x02\x00\x00\x00i1q\x12\x89\x88\x87q\x13Rq\x14(K\x03X\x01'
+               b'\x00\x00\x00|q\x15NNNJ\xff\xff\xff\xffJ\xff\xff\xff\xffK\x00tq\x16b\x89h\tX\x06\x00'
+               b'\x00\x00\x00\x01\x02\x03\x03\x01q\x17h\x0b\x86q\x18Rq\x19tq\x1abubh\x01)\x81q\x1b}q'
+               b'\x1c(h\x04K\x02h\x05h\x06h\x07K\x00\x85q\x1dh\r\x87q\x1eRq\x1f(K\x01K\x02\x85q h\x14'
+               b'\x89h\tX\x02\x00\x00\x00\x01\x00q!h\x0b\x86q"Rq#tq$bube.')
+        x, y = pickle.loads(old)
+        self.assertTrue(x == sec.QaryString(4, [0, 1, 2, 3, 3, 1]))
+        self.assertTrue(y == sec.QaryString(2, [1, 0]))
+        self.assertEqual(x.syndrome, sec.QaryString(4, [0, 1, 2, 3, 3, 1]).syndrome)
+        # PackedQaryString(4, [0, 1, 2, 3, 3, 1]) from before __slots__
+        old = (b'\x80\x02csingle_edit_code.qary_string\nPackedQaryString\nq\x00)\x81q\x01}q\x02(X'
+               b'\x01\x00\x00\x00qq\x03K\x04X\x04\x00\x00\x00dataq\x04cnumpy.core.multiarray\n_rec'
+               b'onstruct\nq\x05cnumpy\nndarray\nq\x06K\x00\x85q\x07c_codecs\nencode\nq\x08X\x01\x00'
+               b'\x00\x00bq\tX\x06\x00\x00\x00latin1q\n\x86q\x0bRq\x0c\x87q\rRq\x0e(K\x01K\x02\x85q'
+               b'\x0fcnumpy\ndtype\nq\x10X\x02\x00\x00\x00u1q\x11\x89\x88\x87q\x12Rq\x13(K\x03X\x01'
+               b'\x00\x00\x00|q\x14NNNJ\xff\xff\xff\xffJ\xff\xff\xff\xffK\x00tq\x15b\x89h\x08X\x03'
+               b'\x00\x00\x00\x1b\xc3\x90q\x16h\n\x86q\x17Rq\x18tq\x19bX\x01\x00\x00\x00nq\x1aK\x06ub.')
+        x = pickle.loads(old)
+        self.assertIs(type(x), sec.PackedQaryString)
+        self.assertEqual((x.q, x.length), (4, 6))
+        self.assertTrue(x.unpack() == sec.QaryString(4, [0, 1, 2, 3, 3, 1]))
+
+class TestArchive(unittest.TestCase):
+    def test_roundtrip(self):
+        code = sec.SingleEditCode(32)
+        records = []
+        for i in range(50):
+            x = sec.QaryString(4, np.random.randint(low=0, high=4, size=np.random.randint(0, 120)))
+            x_enc, n, N, l = code.encode(x)
+            records.append((x_enc.mutate()[0] if i % 2 else x_enc, n, N, l, x))
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "codewords.seca")
+            self.assertEqual(sec.write_archive(path, [r[:4] for r in records]), 50)
+            with sec.ArchiveReader(path) as reader:
+                self.assertEqual(len(reader), 50)
+                for frame, (y, n, N, l, x) in zip(reader, records):
+                    self.assertTrue(isinstance(frame.codeword, sec.PackedQaryString))
+                    self.assertTrue(np.all(frame.codeword.val == y.val))
+                    self.assertEqual((frame.n, frame.N, frame.l), (n, N, l))
+                    self.assertTrue(code.decode(frame.codeword, n, N, l) == x)
+                self.assertEqual(reader[-1].index, 49)
+                with self.assertRaises(IndexError):
+                    reader[50]
+                
+    def test_decode_subset(self):
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        code = sec.SingleEditCode(32)
+        X = np.random.randint(low=0, high=4, size=(300, 80))
+        X_enc, n, N, l = code.encode_batch(X)
+        records = [(sec.QaryString(4, X_enc[i, :N[i]]).mutate()[0], n[i], N[i], l[i]) for i in range(300)]
+        records[7] = (np.zeros(N[7] + 3, dtype=int),) + records[7][1:]
+        indices = [250, 7, 3, 99] + list(range(100, 140))
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "codewords.seca")
+            sec.write_archive(path, records)
+            with sec.ArchiveReader(path) as reader, ThreadPoolExecutor(2) as threads:
+                for kwargs in [{}, {"executor": threads}]:
+                    results = list(reader.decode(code, indices, batch_size=16, **kwargs))
+                    self.assertEqual([i for i, _ in results], indices)
+                    for i, message in results:
+                        if i == 7:
+                            self.assertTrue(isinstance(message, sec.ItemError))
+                            self.assertEqual(message.index, 7)
+                        else:
+                            self.assertTrue(np.all(message == X[i]))
+                with sec.SingleEditCodePool(32, processes=2) as pool:
+                    results = list(reader.decode(pool, indices, batch_size=16))
+                self.assertEqual([i for i, _ in results], indices)
+                self.assertTrue(np.all(results[0][1] == X[250]))
+                with ProcessPoolExecutor(1) as processes, self.assertRaises(Exception):
+                    list(reader.decode(code, indices, executor=processes))
+
+    def test_varint(self):
+        for x in [0, 1, 127, 128, 300, 2**40]:
+            self.assertEqual(sec.archive._decode_varint(sec.archive._encode_varint(x), 0)[0], x)
+
+class TestSVTCodeBatch(unittest.TestCase):
+    def test_batch_matches_single(self):
+        code = sec.SVTCode()
+        for decode, decode_batch, mutate in [
+                (code.decode_deletion, code.decode_deletion_batch, "delete"),
+                (code.decode_insertion, code.decode_insertion_batch, "insert")]:
+            Y, lengths, args, expected = [], [], [], []
+            for i in range(200):
+                y = sec.QaryString(2, np.random.randint(0, 2, np.random.randint(2, 30)))
+                yp, _, pos, symbol = y.mutate(mtype=mutate)
+                u = np.random.randint(low=1, high=pos+2)
+                P = np.random.randint(low=pos+2-u, high=40)
+                y_pred = decode(yp, y.syndrome, u, P, symbol)
+                self.assertTrue(y_pred == y)
+                Y.append(np.pad(yp.val, (0, 31 - yp.length)))
+                lengths.append(yp.length)
+                args.append((y.syndrome, u, P, symbol))
+                expected.append(y.val)
+            a, u, P, val = (np.array(v) for v in zip(*args))
+            X, n = decode_batch(np.array(Y), a, u, P, val, lengths=lengths)
+            for i, y in enumerate(expected):
+                self.assertEqual(n[i], len(y))
+                self.assertTrue(np.all(X[i, :n[i]] == y))
+                
+class TestSVTCodeEncode(unittest.TestCase):
+    def test_roundtrip(self):
+        P = 12
+        code = sec.SVTCode(P)
+        X, Y, n, a, c, u, lengths = [], [], [], [], [], [], []
+        for i in range(300):
+            x = sec.QaryString(2, np.random.randint(0, 2, np.random.randint(2, 50)))
+            a_i, c_i = code.encode(x)
+            self.assertEqual((a_i, c_i), (x.syndrome % P, x.parity_check))
+            mtype = ["insert", "delete", "none"][i % 3]
+            y, pos = (x, 0) if mtype == "none" else x.mutate(mtype=mtype)[::2]
+            u_i = np.random.randint(low=max(1, pos + 3 - P), high=pos + 2)
+            self.assertTrue(code.decode(y, x.length, a_i, c_i, u_i) == x)
+            X.append(np.pad(x.val, (0, 50 - x.length)))
+            Y.append(np.pad(y.val, (0, 51 - y.length)))
+            lengths.append(y.length)
+            n.append(x.length)
+            a.append(a_i)
+            c.append(c_i)
+            u.append(u_i)
+        a_b, c_b = code.encode_batch(np.array(X), lengths=n)
+        self.assertTrue(np.all(a_b == a) and np.all(c_b == c))
+        X_dec, n_dec = code.decode_batch(np.array(Y), n, a, c, u, lengths=lengths)
+        self.assertTrue(np.all(n_dec == n))
+        for i, x in enumerate(X):
+            self.assertTrue(np.all(X_dec[i, :n[i]] == x[:n[i]]))
+        
 class TestCombinatorialBitstringEncoder(unittest.TestCase):
     def test1_random(self):          
         for i in range(1000):
@@ -118,6 +729,96 @@ class TestCombinatorialBitstringEncoder(unittest.TestCase):
             b_pred = sec.CombinatorialBitstringEncoder.decode(k,w,index)
             self.assertTrue(np.all(b_pred == b))
             
+class TestBinomialTable(unittest.TestCase):
+    def test_matches_combinatorial_encoder(self):
+        table = sec.BinomialTable.for_k(64)
+        self.assertIs(table, sec.SumBalancedCode(64).ranker)
+        for i in range(200):
+            b = np.random.randint(low=0, high=2, size=64)
+            k, w, index = sec.CombinatorialBitstringEncoder.encode(b)
+            self.assertEqual(table.rank(b), (k, w, index))
+            self.assertTrue(np.all(table.unrank(w, index) == b))
+            
+class TestForbiddenWordIndex(unittest.TestCase):
+    def test_bucket_boundaries(self):
+        code = sec.SumBalancedCode(16)
+        for bucket in range(len(code.bucket2startidx)):
+            start = code.bucket2startidx[bucket]
+            for index in [start, start + code.bucket2size[bucket] - 1]:
+                word = code._index_to_fword(index)
+                self.assertFalse(word.is_sum_balanced)
+                self.assertEqual(code._fword_to_index(word), index)
+                
+    def test_balanced_word_has_no_index(self):
+        code = sec.SumBalancedCode(16)
+        with self.assertRaises(Exception):
+            code._fword_to_index(sec.QaryString(4, [1, 2] * 8))
+            
+    def test_lru_cache(self):
+        x = sec.QaryString(4, np.zeros(300, dtype=int))
+        for size, cached in [(16, True), (0, False)]:
+            code = sec.SumBalancedCode(32, cache_size=size)
+            y, l = code.encode(x)
+            self.assertTrue(code.decode(y, l) == x)
+            info = code.cache_info()
+            self.assertEqual(info["rank"].maxsize, size)
+            self.assertEqual(info["rank"].hits > 0, cached)
+            self.assertEqual(info["unrank"].hits > 0, cached)
+            self.assertTrue(info["rank"].currsize <= size)
+        word = code._index_to_fword(5)
+        word.val[0] = 3 - word.val[0]
+        self.assertFalse(code._index_to_fword(5) == word)
+            
+class TestTableCache(unittest.TestCase):
+    def test_cached_tables_match(self):
+        with tempfile.TemporaryDirectory() as d:
+            built = sec.SumBalancedCode(24, cache_dir=d)
+            loaded = sec.SumBalancedCode(24, cache_dir=d)
+            self.assertIsNotNone(loaded._table_mmap)
+            fresh = sec.SumBalancedCode(24)
+            for code in [built, loaded]:
+                self.assertEqual(code._num_fwords, fresh._num_fwords)
+                self.assertEqual(list(code.bucket2startidx), fresh.bucket2startidx)
+                self.assertEqual(list(code.bucket2size), fresh.bucket2size)
+                self.assertTrue(np.all(code.sumpair2bucket == fresh.sumpair2bucket))
+            s = sec.QaryString(4, np.zeros(200))
+            x, l = loaded.encode(s)
+            self.assertTrue(x == fresh.encode(s)[0])
+            self.assertTrue(loaded.decode(x, l) == s)
+            
+    def test_corrupt_cache_is_rebuilt(self):
+        with tempfile.TemporaryDirectory() as d:
+            sec.SumBalancedCode(24, cache_dir=d)
+            path = sec.table_cache.cache_path(d, 24)
+            with open(path, "r+b") as f:
+                f.seek(-1, 2)
+                last = f.read(1)
+                f.seek(-1, 2)
+                f.write(bytes([last[0] ^ 0xff]))
+            code = sec.SumBalancedCode(24, cache_dir=d)
+            self.assertIsNone(code._table_mmap)
+            self.assertEqual(code._num_fwords, sec.SumBalancedCode(24)._num_fwords)
+            self.assertIsNotNone(sec.SumBalancedCode(24, cache_dir=d)._table_mmap)
+            
+    def test_cache_file_permissions(self):
+        from unittest import mock
+        with tempfile.TemporaryDirectory() as d:
+            # Saving must not touch the process-wide umask
+            with mock.patch("os.umask", side_effect=AssertionError("umask changed")):
+                sec.SumBalancedCode(24, cache_dir=d)
+            if os.name == "posix":
+                mode = os.stat(sec.table_cache.cache_path(d, 24)).st_mode & 0o777
+                self.assertEqual(mode, 0o666 & ~sec.table_cache._UMASK)
+            
+    def test_unwritable_cache_dir(self):
+        with tempfile.TemporaryDirectory() as d:
+            # A directory below a regular file can be neither read nor created
+            blocker = os.path.join(d, "file")
+            open(blocker, "w").close()
+            code = sec.SumBalancedCode(24, cache_dir=os.path.join(blocker, "cache"))
+            self.assertIsNone(code._table_mmap)
+            self.assertEqual(code._num_fwords, sec.SumBalancedCode(24)._num_fwords)
+            
 class TestSumBalancedCode(unittest.TestCase):
     k = 32
     code = sec.SumBalancedCode(k)
@@ -128,5 +829,60 @@ class TestSumBalancedCode(unittest.TestCase):
         s_pred = code.decode(x, l)
         assert s == s_pred
         
+def reference_sum_balanced_encode(code, s):
+    """
+    The original concatenate-and-rewind encoder, kept to check that the
+    sliding-window encoder produces identical codewords. 
+    """
+    x = s.concatenate(sec.QaryString(s.q, [0]))
+    i = 0
+    k = code.k
+    while i <= x.length - k:
+        word = x[i:i+k]
+        if not word.is_sum_balanced:
+            index = code._fword_to_index(word)
+            x = x[:i].concatenate([
+                x[i+k:], 
+                sec.QaryString(x.q).fromint(index).pad_to(x.bitlen(code._num_fwords)),
+                sec.QaryString(x.q).fromint(i).pad_to(x.bitlen(s.length)),
+                sec.QaryString(x.q, val=[3])
+            ])
+            i = i - min(i, k)
+        else: 
+            i += 1
+    return x, s.length
+
+class TestSumBalancedEncoder(unittest.TestCase):
+    def test_matches_reference(self):
+        code = sec.SumBalancedCode(32)
+        inputs = [np.zeros(300), np.full(300, 3), np.arange(300) % 4, np.zeros(20)]
+        for i in range(100):
+            n = np.random.randint(1, 400)
+            inputs.append(np.random.randint(low=0, high=4, size=n))
+            inputs.append(np.random.choice([0, 0, 0, 3], size=n))
+        for val in inputs:
+            s = sec.QaryString(4, val)
+            x, l = code.encode(s)
+            x_ref, _ = reference_sum_balanced_encode(code, s)
+            self.assertEqual(x.length, x_ref.length)
+            self.assertTrue(x == x_ref)
+            self.assertTrue(code.decode(x, l) == s)
+            
+    def test_whiten(self):
+        code = sec.SingleEditCode(128, whiten=True)
+        self.assertTrue(np.all(sec.util.keystream(1001)[:999] == sec.util.keystream(999)))
+        for val in [np.zeros(5000, dtype=int), np.full(777, 3), np.random.randint(0, 4, size=300), []]:
+            x = sec.QaryString(4, val)
+            with sec.Stats() as stats:
+                x_enc, n, N, l = code.encode(x)
+            self.assertEqual(stats.histograms["sum_balance.replacements"].total, 0)
+            self.assertEqual(n, len(val) + 1)
+            self.assertTrue(code.decode(x_enc.mutate()[0] if len(val) else x_enc, n, N, l) == x)
+            
+    def test_position_overflow(self):
+        # Blocks are longer than k = 16, so long low-entropy input overflows
+        with self.assertRaises(Exception):
+            sec.SumBalancedCode(16).encode(sec.QaryString(4, np.zeros(2000, dtype=int)))
+        
 if __name__ == "__main__":
     unittest.main()